@@ -0,0 +1,121 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def hour_bucket(moment):
+    """Truncate a datetime to the start of its hour (the analytics bucket key)."""
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def recent_buckets_since(hours):
+    """Start of the oldest bucket covered by a rollup over the last `hours` hours."""
+    return hour_bucket(datetime.utcnow()) - timedelta(hours=hours - 1)
+
+
+class AnalyticsAggregator:
+    """
+    Coalesces analytics $inc counters in memory and writes them with bulk_write.
+
+    Counters are keyed by (collection, filter), so totals on the per-user
+    analytics document and hourly analytics_buckets rows share one flush.
+
+    increment() only touches memory. A background thread flushes every
+    flush_interval seconds, or sooner once max_pending increments have
+    queued up, and close() (also run at exit) flushes whatever is left.
+    A failed flush puts its counters back so no stats are lost.
+    """
+
+    def __init__(self, get_collection, flush_interval=config.ANALYTICS_FLUSH_INTERVAL,
+                 max_pending=config.ANALYTICS_FLUSH_THRESHOLD):
+        self._get_collection = get_collection
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}  # (collection name, sorted filter items) -> Counter of $inc fields
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="analytics-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def increment(self, match, counters, collection="analytics"):
+        """Queue {field: amount} increments for the document selected by `match`."""
+        key = (collection, tuple(sorted(match.items())))
+        with self._lock:
+            self._pending.setdefault(key, Counter()).update(counters)
+            self._pending_events += 1
+            if self._pending_events >= self.max_pending:
+                self._wake.set()
+
+    def pending(self, match, collection="analytics"):
+        """Counters queued for `match` that have not been written yet."""
+        key = (collection, tuple(sorted(match.items())))
+        with self._lock:
+            return dict(self._pending.get(key, {}))
+
+    def flush(self):
+        """Write queued counters with one unordered bulk_write per collection. Returns the number of documents updated."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_events = 0
+            if not batch:
+                return 0
+
+            by_collection = {}
+            for key in batch:
+                by_collection.setdefault(key[0], []).append(key)
+            return sum(self._flush_collection(name, keys, batch) for name, keys in by_collection.items())
+
+    def _flush_collection(self, name, keys, batch):
+        now = datetime.utcnow()
+        ops = [
+            UpdateOne(dict(key[1]), {"$inc": dict(batch[key]), "$set": {"updated_at": now}}, upsert=True)
+            for key in keys
+        ]
+        try:
+            self._get_collection(name).bulk_write(ops, ordered=False)
+            logger.debug(f"Flushed {name} counters for {len(ops)} documents")
+            return len(ops)
+        except BulkWriteError as e:
+            # Unordered: everything except the reported failures was applied
+            failed = [keys[err["index"]] for err in e.details.get("writeErrors", [])]
+            logger.error(f"Failed to flush {len(failed)}/{len(ops)} {name} documents, will retry")
+            self._requeue({key: batch[key] for key in failed})
+            return len(ops) - len(failed)
+        except Exception as e:
+            logger.error(f"Failed to flush {name} counters, will retry: {e}")
+            self._requeue({key: batch[key] for key in keys})
+            return 0
+
+    def _requeue(self, batch):
+        with self._lock:
+            for key, counters in batch.items():
+                self._pending.setdefault(key, Counter()).update(counters)
+
+    def close(self):
+        """Stop the flusher thread and write any remaining counters."""
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._wake.set()
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._stopped.is_set():
+                self.flush()
@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import inspect
+import logging
+
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import AsyncMongoClient
+
+import config
+from database import MONGO_CLIENT_OPTIONS, UserSettings, fields_projection, keyset_page_args, user_settings_pipeline
+from executor import cpu_executor, decode_bson_field
+from metrics import instrument_methods
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEnhancedDatabaseManager:
+    """
+    Async version of EnhancedDatabaseManager with the same method surface.
+
+    Methods on the broadcast/login hot path are implemented natively on
+    pymongo's AsyncMongoClient. Every other public method of the sync manager
+    is exposed as a coroutine that runs in the default executor, so no call
+    made from a coroutine blocks the event loop.
+    """
+
+    def __init__(self, sync_manager):
+        self.sync = sync_manager
+        # AsyncMongoClient connects lazily on the first awaited operation
+        self.client = AsyncMongoClient(config.MONGO_URI, **MONGO_CLIENT_OPTIONS)
+        self.db = self.client[config.DB_NAME]
+        self.users = self.db.users
+        self.accounts = self.db.accounts
+        # users documents can be large (saved_messages); this view leaves them
+        # as raw bytes so decoding happens on the CPU executor, not the loop
+        self.raw_users = self.db.get_collection("users", codec_options=CodecOptions(document_class=RawBSONDocument))
+
+    def __getattr__(self, name):
+        """Expose any sync manager method as an executor-backed coroutine."""
+        attr = getattr(self.sync, name)
+        if name.startswith('_') or not inspect.ismethod(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def offloaded(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return offloaded
+
+    # ================= USER MANAGEMENT =================
+
+    async def get_user(self, user_id, fields=None):
+        """Fetch user data, optionally only `fields` plus _id."""
+        try:
+            return await self.db.users.find_one({"user_id": user_id}, fields_projection(fields))
+        except Exception as e:
+            logger.error(f"Failed to get user {user_id}: {e}")
+            return None
+
+    async def is_user_premium(self, user_id):
+        """Check if user has premium status"""
+        try:
+            return await self.db.users.find_one({"user_id": user_id, "user_type": "premium"}, {"_id": 1}) is not None
+        except Exception as e:
+            logger.error(f"Failed to check premium status for {user_id}: {e}")
+            return False
+
+    # ================= ACCOUNT MANAGEMENT =================
+
+    async def get_user_accounts(self, user_id):
+        """Fetch all accounts for a user, sorted by account_index."""
+        try:
+            cursor = self.db.accounts.find({"user_id": user_id}).sort("account_index", 1)
+            return await cursor.to_list(length=None)
+        except Exception as e:
+            logger.error(f"Failed to get accounts for {user_id}: {e}")
+            return []
+
+    async def iter_all_user_accounts(self, query=None, projection=None, batch_size=config.SCAN_BATCH_SIZE):
+        """Async-iterate all accounts in _id order with constant memory."""
+        async for account in self._iter_keyset(self.db.accounts, query, projection, batch_size):
+            yield account
+
+    async def get_user_accounts_count(self, user_id):
+        """Count user's accounts."""
+        try:
+            return await self.db.accounts.count_documents({"user_id": user_id})
+        except Exception as e:
+            logger.error(f"Failed to count accounts for {user_id}: {e}")
+            return 0
+
+    # ================= STREAMING SCANS =================
+
+    async def iter_users(self, query=None, projection=None, batch_size=config.SCAN_BATCH_SIZE):
+        """Async-iterate users in _id order with constant memory."""
+        async for user in self._iter_keyset(self.db.users, query, projection, batch_size):
+            yield user
+
+    @staticmethod
+    async def _iter_keyset(collection, query, projection, batch_size):
+        """Async twin of database.iter_keyset."""
+        after_id = None
+        while True:
+            page_query, page_projection = keyset_page_args(query, projection, after_id)
+            batch = await collection.find(page_query, page_projection).sort("_id", 1).limit(batch_size).to_list(length=None)
+            for doc in batch:
+                yield doc
+            if len(batch) < batch_size:
+                return
+            after_id = batch[-1]["_id"]
+
+    # ================= USER SETTINGS SNAPSHOT =================
+
+    async def get_user_settings(self, user_id):
+        """Async twin of EnhancedDatabaseManager.get_user_settings, sharing its cache."""
+        settings = self.sync.settings_cache.get(user_id)
+        if settings is not None:
+            return settings
+        try:
+            cursor = await self.db.users.aggregate(user_settings_pipeline(user_id))
+            settings = UserSettings.from_rows(user_id, await cursor.to_list(length=None))
+            self.sync.settings_cache.set(user_id, settings)
+            return settings
+        except Exception as e:
+            logger.error(f"Failed to load settings for {user_id}: {e}")
+            return UserSettings(user_id=user_id)
+
+    async def get_user_group_msg_delay(self, user_id):
+        """Get user's group message delay. Default is 15 seconds."""
+        return (await self.get_user_settings(user_id)).group_msg_delay
+
+    # ================= API CREDENTIALS MANAGEMENT =================
+
+    async def get_user_api_credentials(self, user_id):
+        """Get user's API credentials"""
+        settings = await self.get_user_settings(user_id)
+        if settings.api_id is not None and settings.api_hash is not None:
+            return {
+                "api_id": settings.api_id,
+                "api_hash": settings.api_hash
+            }
+        return None
+
+    # ================= SAVED MESSAGES =================
+
+    async def get_saved_messages(self, user_id):
+        """Get all saved messages for a user"""
+        try:
+            raw = await self.raw_users.find_one({"user_id": user_id}, {"saved_messages": 1})
+            if raw is None:
+                return []
+            return await cpu_executor.run("bson_decode", decode_bson_field, raw.raw, "saved_messages", [])
+        except Exception as e:
+            logger.error(f"Failed to get saved messages for {user_id}: {e}")
+            return []
+
+    async def close(self):
+        """Close the async MongoDB connection."""
+        try:
+            await self.client.close()
+            logger.info("Async MongoDB connection closed")
+        except Exception as e:
+            logger.error(f"Failed to close async MongoDB connection: {e}")
+            raise
+
+
+# Native async methods; offloaded ones are timed by the sync manager's instrumentation
+instrument_methods(AsyncEnhancedDatabaseManager, prefix="async.")
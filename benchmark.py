@@ -0,0 +1,307 @@
+"""
+Benchmarks for the bot's hot paths.
+
+Runs against a local mongod only. MONGO_URI must be set explicitly and
+point at localhost (set BENCH_ALLOW_REMOTE=true for another disposable
+server), and BENCH_DB_NAME may not be the production DB_NAME:
+
+    MONGO_URI=mongodb://localhost:27017 python benchmark.py db --concurrency 200
+    MONGO_URI=mongodb://localhost:27017 python benchmark.py broadcast --users 1,10 --accounts 1,5 --groups 50,200
+
+The broadcast scenario drives broadcast_engine.run_cycle (the cycle
+main.start_broadcast_cycle runs) with fake Pyrogram clients (configurable
+latency, FloodWait and RPC error rates) started through the real pool, so
+the rate limiter, checkpoint and analytics paths are the shipped ones. It
+reports one row per point of the users x accounts x groups matrix.
+
+The benchmark database is dropped when the run finishes.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import time
+
+from pymongo import monitoring
+from pyrogram.errors import ChatWriteForbidden, FloodWait
+
+import config
+
+PRODUCTION_DB_NAME = config.DB_NAME
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1", "[::1]"}
+config.DB_NAME = os.getenv("BENCH_DB_NAME", "AdsBot_bench")
+
+import broadcast_engine  # noqa: E402
+from checkpoint import BroadcastCheckpoint  # noqa: E402
+from client_pool import ClientPool  # noqa: E402
+from database import EnhancedDatabaseManager  # noqa: E402
+from async_database import AsyncEnhancedDatabaseManager  # noqa: E402
+from rate_limiter import AdaptiveRateLimiter  # noqa: E402
+
+PROBE_INTERVAL = 0.005
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands sent by every client created after registration."""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values (0 when empty)."""
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+async def probe_loop_lag(samples, stop):
+    """Record how late the event loop wakes a sleeping coroutine."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append((loop.time() - started - PROBE_INTERVAL) * 1000)
+
+
+async def measure(label, make_task, concurrency):
+    """Run `concurrency` tasks while probing loop lag and print a report line."""
+    samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(make_task(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    print(
+        f"{label:<6} wall={elapsed:.3f}s "
+        f"lag p50={percentile(samples, 50):.2f}ms "
+        f"p99={percentile(samples, 99):.2f}ms "
+        f"max={max(samples, default=0):.2f}ms"
+    )
+
+
+def seed_users(sync_db, users, accounts_per_user):
+    """Create benchmark users with API credentials and accounts."""
+    sync_db.db.users.insert_many([
+        {"user_id": uid, "api_id": 1, "api_hash": "bench"} for uid in range(users)
+    ])
+    sync_db.db.accounts.insert_many([
+        {"user_id": uid, "phone_number": f"+1000{uid}{n}", "session_string": "x", "account_index": n + 1}
+        for uid in range(users) for n in range(accounts_per_user)
+    ])
+
+
+async def bench_db(args):
+    sync_db = EnhancedDatabaseManager()
+    async_db = AsyncEnhancedDatabaseManager(sync_db)
+    try:
+        seed_users(sync_db, args.users, args.accounts)
+
+        async def blocking_lookup(i):
+            uid = i % args.users
+            sync_db.get_user_accounts(uid)
+            sync_db.get_user_api_credentials(uid)
+            await asyncio.sleep(0)
+
+        async def async_lookup(i):
+            uid = i % args.users
+            await async_db.get_user_accounts(uid)
+            await async_db.get_user_api_credentials(uid)
+
+        print(f"db: {args.concurrency} concurrent broadcast lookups over {args.users} users")
+        await measure("sync", blocking_lookup, args.concurrency)
+        await measure("async", async_lookup, args.concurrency)
+    finally:
+        sync_db.client.drop_database(config.DB_NAME)
+        await async_db.close()
+        sync_db.client.close()
+
+
+class FakeClient:
+    """Stands in for a Pyrogram client: sends sleep for `latency` and fail at the given rates."""
+
+    def __init__(self, latency, flood_rate, flood_seconds, error_rate, start_latency, rng):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.error_rate = error_rate
+        self.start_latency = start_latency
+        self.rng = rng
+        self.is_connected = False
+
+    async def start(self):
+        await asyncio.sleep(self.start_latency)
+        self.is_connected = True
+
+    async def stop(self):
+        self.is_connected = False
+
+    async def get_me(self):
+        return None
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.latency)
+        roll = self.rng.random()
+        if roll < self.flood_rate:
+            raise FloodWait(value=self.flood_seconds)
+        if roll < self.flood_rate + self.error_rate:
+            raise ChatWriteForbidden()
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+async def run_fake_cycle(args, async_db, pool, limiter, user_id, accounts, groups, latencies):
+    """
+    One user's cycle through broadcast_engine.run_cycle (the code main.start_broadcast_cycle
+    runs), with fake clients started and released through the real ClientPool.
+    """
+    rng = random.Random(user_id)
+
+    async def load(n):
+        acc_id = f"{user_id}-{n}"
+        client = await pool.acquire(acc_id, lambda: FakeClient(
+            args.latency, args.flood_rate, args.flood_seconds, args.error_rate, args.start_latency, rng
+        ))
+        return {'client': client, 'db_id': acc_id, 'index': n + 1, 'phone': 'bench'}
+
+    def release(clients):
+        for client_info in clients:
+            pool.release(client_info['db_id'])
+
+    async def timed_send(client, group_id, message):
+        started = time.perf_counter()
+        try:
+            return await broadcast_engine.send_ad(client, group_id, message)
+        finally:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    clients = await asyncio.gather(*(load(n) for n in range(accounts)))
+    return await broadcast_engine.run_cycle(
+        user_id, clients,
+        [{'message_id': m + 1} for m in range(args.messages)],
+        [-(1000000 + g) for g in range(groups)],
+        async_db, limiter, BroadcastCheckpoint(async_db.db.broadcast_states, user_id), release,
+        send=timed_send, max_flood_wait=args.max_flood_wait
+    )
+
+
+async def bench_broadcast(args):
+    sync_db = EnhancedDatabaseManager()
+    async_db = AsyncEnhancedDatabaseManager(sync_db)
+    print(
+        f"broadcast: latency={args.latency * 1000:.0f}ms flood={args.flood_rate:.1%} "
+        f"errors={args.error_rate:.1%} interval={args.interval}s messages={args.messages}"
+    )
+    print(f"{'users':>5} {'accts':>5} {'groups':>6} {'sent':>7} {'failed':>6} {'skipped':>7} "
+          f"{'msg/s':>8} {'p50 ms':>7} {'p99 ms':>7} {'db/msg':>6} {'lag p99':>8}")
+    try:
+        # run_cycle paces each account at the user's group message delay
+        sync_db.db.group_msg_delays.insert_many([
+            {"user_id": uid, "delay": args.interval} for uid in range(max(args.users))
+        ])
+        for users, accounts, groups in itertools.product(args.users, args.accounts, args.groups):
+            pool = ClientPool()
+            limiter = AdaptiveRateLimiter(min_interval=args.interval, chat_interval=0, jitter=0)
+            latencies, lag = [], []
+            stop = asyncio.Event()
+            probe = asyncio.create_task(probe_loop_lag(lag, stop))
+            commands_before = command_counter.count
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                run_fake_cycle(args, async_db, pool, limiter, uid, accounts, groups, latencies)
+                for uid in range(users)
+            ))
+            # Pending analytics counters are part of the cost of the cycle
+            await asyncio.to_thread(sync_db.analytics_writer.flush)
+            elapsed = time.perf_counter() - started
+
+            stop.set()
+            await probe
+            await pool.close()
+
+            sent = sum(r['sent'] for r in results)
+            failed = sum(r['failed'] for r in results)
+            skipped = sum(r['skipped'] for r in results)
+            attempted = max(sent + failed, 1)
+            print(
+                f"{users:>5} {accounts:>5} {groups:>6} {sent:>7} {failed:>6} {skipped:>7} "
+                f"{attempted / elapsed:>8.1f} {percentile(latencies, 50):>7.1f} {percentile(latencies, 99):>7.1f} "
+                f"{(command_counter.count - commands_before) / attempted:>6.2f} {percentile(lag, 99):>6.2f}ms"
+            )
+            sync_db.db.broadcast_states.delete_many({})
+    finally:
+        sync_db.client.drop_database(config.DB_NAME)
+        await async_db.close()
+        sync_db.client.close()
+
+
+def check_target():
+    """Refuse to seed and drop anything but an explicitly configured, disposable database."""
+    uri = os.getenv("MONGO_URI")
+    if not uri:
+        raise SystemExit("benchmark: set MONGO_URI explicitly (e.g. mongodb://localhost:27017); "
+                         "the config fallback is the production cluster")
+    if config.DB_NAME == PRODUCTION_DB_NAME:
+        raise SystemExit(f"benchmark: BENCH_DB_NAME may not be the production database {PRODUCTION_DB_NAME!r}")
+    hosts = uri.split("://", 1)[-1].split("/", 1)[0].rsplit("@", 1)[-1]
+    remote = uri.startswith("mongodb+srv://") or any(
+        host.rsplit(":", 1)[0] not in LOCAL_HOSTS for host in hosts.split(",")
+    )
+    if remote and os.getenv("BENCH_ALLOW_REMOTE", "false").lower() != "true":
+        raise SystemExit("benchmark: MONGO_URI is not a localhost server; set BENCH_ALLOW_REMOTE=true "
+                         "if it is a disposable one")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    db_parser = sub.add_parser("db", help="event-loop lag of sync vs async database calls")
+    db_parser.add_argument("--concurrency", type=int, default=200)
+    db_parser.add_argument("--users", type=int, default=50)
+    db_parser.add_argument("--accounts", type=int, default=5)
+    db_parser.set_defaults(func=bench_db)
+
+    bc_parser = sub.add_parser("broadcast", help="fan-out throughput, send latency and DB cost with fake clients")
+    bc_parser.add_argument("--users", type=int_list, default=[1, 10], help="comma-separated scale points")
+    bc_parser.add_argument("--accounts", type=int_list, default=[1, 5], help="accounts per user")
+    bc_parser.add_argument("--groups", type=int_list, default=[50, 200], help="target groups per user")
+    bc_parser.add_argument("--messages", type=int, default=1, help="saved messages per cycle")
+    bc_parser.add_argument("--latency", type=float, default=0.05, help="mean send latency in seconds")
+    bc_parser.add_argument("--start-latency", type=float, default=0.2, help="client start latency in seconds")
+    bc_parser.add_argument("--flood-rate", type=float, default=0.01, help="fraction of sends raising FloodWait")
+    bc_parser.add_argument("--flood-seconds", type=int, default=1)
+    bc_parser.add_argument("--error-rate", type=float, default=0.02, help="fraction of sends raising an RPC error")
+    bc_parser.add_argument("--interval", type=float, default=0.01, help="per-account send interval in seconds")
+    bc_parser.add_argument("--max-flood-wait", type=int, default=config.MAX_FLOOD_WAIT)
+    bc_parser.set_defaults(func=bench_broadcast)
+
+    args = parser.parse_args()
+    check_target()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+
+from pyrogram.errors import FloodWait
+
+import config
+from metrics import FLOOD_WAIT_SECONDS, FLOOD_WAITS, SEND_LATENCY, SENDS
+
+logger = logging.getLogger(__name__)
+
+
+def group_id_of(group):
+    """Accept either a target_groups document or a raw chat id."""
+    return group['group_id'] if isinstance(group, dict) else group
+
+
+def message_id_of(message):
+    """Accept either a saved_messages entry or a Pyrogram Message."""
+    return message['message_id'] if isinstance(message, dict) else message.id
+
+
+def split_groups(target_groups, shards):
+    """Deal target_groups round-robin into `shards` lists of near-equal size."""
+    if shards < 1:
+        return []
+    return [target_groups[i::shards] for i in range(shards)]
+
+
+async def send_ad(client, group_id, message):
+    """Copy one saved message from the account's Saved Messages into a group."""
+    return await client.copy_message(
+        chat_id=group_id,
+        from_chat_id="me",
+        message_id=message_id_of(message)
+    )
+
+
+async def fan_out(user_id, clients, saved_messages, target_groups, limiter,
+                  send=send_ad, on_result=None, max_flood_wait=config.MAX_FLOOD_WAIT,
+                  checkpoint=None):
+    """
+    Split target_groups across all live accounts and send through them concurrently.
+
+    Every (message, group) pair is sent exactly once by the account that owns
+    the group's shard. Each account is paced by `limiter` (an
+    AdaptiveRateLimiter keyed by account db_id and chat) and has its own flood
+    budget: it waits out FloodWaits until their total exceeds max_flood_wait,
+    then stops and leaves its remaining groups unsent.
+
+    on_result(client_info, group_id, success, error) is awaited after every send.
+    If a checkpoint (BroadcastCheckpoint) is given, pairs it already holds are
+    not sent again and every attempt is recorded to it.
+    Returns {'sent': int, 'failed': int, 'skipped': int}.
+    """
+    if not clients or not saved_messages or not target_groups:
+        return {'sent': 0, 'failed': 0, 'skipped': 0}
+
+    shards = split_groups(target_groups, len(clients))
+    results = await asyncio.gather(*(
+        _run_account(user_id, client_info, saved_messages, shard, limiter,
+                     send, on_result, max_flood_wait, checkpoint)
+        for client_info, shard in zip(clients, shards)
+    ))
+
+    summary = {'sent': 0, 'failed': 0, 'skipped': 0}
+    for result in results:
+        for key in summary:
+            summary[key] += result[key]
+    return summary
+
+
+async def run_cycle(user_id, clients, saved_messages, target_groups, db, limiter, checkpoint, release,
+                    send=send_ad, max_flood_wait=config.MAX_FLOOD_WAIT):
+    """
+    One broadcast cycle over clients the caller has already acquired.
+
+    Drops blacklisted groups, paces every account at the user's group message
+    delay (the limiter adapts below that), resumes from and records to
+    `checkpoint` (a BroadcastCheckpoint), and always hands the clients back
+    with release(clients), even if the cycle is cancelled. `db` is the async
+    database manager. Returns the checkpoint's last_cycle totals.
+    Shared by main.start_broadcast_cycle and benchmark.py.
+    """
+    try:
+        group_delay = await db.get_user_group_msg_delay(user_id)
+        target_groups = await db.filter_blacklisted_groups(user_id, target_groups)
+        for client_info in clients:
+            limiter.register_account(client_info['db_id'], group_delay)
+
+        async def record_result(client_info, group_id, success, error):
+            await db.increment_broadcast_stats(user_id, success, group_id, str(client_info['db_id']))
+
+        await checkpoint.load()
+        logger.info(f"User {user_id} - Broadcasting {len(saved_messages)} messages to {len(target_groups)} groups with {len(clients)} accounts")
+        summary = await fan_out(
+            user_id, clients, saved_messages, target_groups, limiter,
+            send=send, on_result=record_result, max_flood_wait=max_flood_wait, checkpoint=checkpoint
+        )
+    finally:
+        # Persist the last partial batch even if the cycle was cancelled or timed out
+        await checkpoint.flush()
+        release(clients)
+
+    # Close the cursor and keep the totals on broadcast_states
+    return await checkpoint.complete(summary)
+
+
+async def _run_account(user_id, client_info, saved_messages, shard, limiter,
+                       send, on_result, max_flood_wait, checkpoint):
+    client = client_info['client']
+    account_id = client_info['db_id']
+    acc_index = client_info['index']
+    counts = {'sent': 0, 'failed': 0, 'skipped': 0}
+    flood_waited = 0
+    pending = [(group_id_of(group), message) for group in shard for message in saved_messages]
+    if checkpoint is not None:
+        pending = [(group_id, message) for group_id, message in pending if not checkpoint.is_done(group_id, message)]
+
+    logger.info(f"User {user_id} - Account ({acc_index}) sending {len(pending)} messages to {len(shard)} groups")
+
+    for position, (group_id, message) in enumerate(pending):
+        error = None
+        while True:
+            await limiter.acquire(account_id, group_id)
+            started = time.perf_counter()
+            try:
+                await send(client, group_id, message)
+                SEND_LATENCY.observe(time.perf_counter() - started, account=account_id)
+                limiter.on_success(account_id)
+                break
+            except FloodWait as e:
+                FLOOD_WAITS.inc()
+                FLOOD_WAIT_SECONDS.inc(e.value)
+                if flood_waited + e.value > max_flood_wait:
+                    counts['skipped'] = len(pending) - position
+                    SENDS.inc(counts['skipped'], result='skipped')
+                    logger.warning(
+                        f"Account ({acc_index}) flood budget exhausted ({flood_waited + e.value}s > {max_flood_wait}s), "
+                        f"leaving {counts['skipped']} messages unsent"
+                    )
+                    return counts
+                flood_waited += e.value
+                logger.warning(f"Account ({acc_index}) FloodWait {e.value}s on group {group_id}")
+                # The limiter blocks this account for e.value, so the next acquire() waits it out
+                limiter.on_flood_wait(account_id, e.value, group_id)
+            except Exception as e:
+                error = e
+                break
+
+        if error is None:
+            counts['sent'] += 1
+            SENDS.inc(result='sent')
+        else:
+            counts['failed'] += 1
+            SENDS.inc(result='failed')
+            logger.warning(f"Broadcast to {group_id} failed by Account ({acc_index}): {error}")
+
+        if checkpoint is not None:
+            await checkpoint.record(group_id, message, error is None)
+        if on_result is not None:
+            await on_result(client_info, group_id, error is None, error)
+
+    logger.info(f"Account ({acc_index}) finished: {counts['sent']} sent, {counts['failed']} failed")
+    return counts
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import config
+from executor import cpu_executor, decrypt_text
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after being set.
+
+    on_evict(key, value), if given, is called for every entry that leaves the
+    cache (expiry, LRU eviction, invalidation or clear).
+    """
+
+    def __init__(self, maxsize, ttl, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        evicted = None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                evicted = self._data.pop(key)
+            else:
+                self._data.move_to_end(key)
+                return value
+        self._notify(key, evicted)
+        return default
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None and old[1] is not value:
+                evicted.append((key, old))
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+        for evicted_key, item in evicted:
+            self._notify(evicted_key, item)
+
+    def invalidate(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        self._notify(key, item)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry for which predicate(key, value) is true."""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            items = [(k, self._data.pop(k)) for k in keys]
+        for key, item in items:
+            self._notify(key, item)
+
+    def clear(self):
+        with self._lock:
+            items, self._data = list(self._data.items()), OrderedDict()
+        for key, item in items:
+            self._notify(key, item)
+
+    def _notify(self, key, item):
+        if item is not None and self.on_evict is not None:
+            self.on_evict(key, item[1])
+
+
+class SessionCache:
+    """
+    Decrypted account session strings keyed by (account _id, ciphertext hash).
+
+    Keying on the ciphertext hash means a re-saved session never serves the
+    old plaintext. Plaintext is held in a bytearray that is overwritten with
+    zeros when the entry expires, is evicted or is invalidated. This is best
+    effort: the str handed to callers is an immutable copy Python may keep.
+    """
+
+    def __init__(self, maxsize=config.SESSION_CACHE_SIZE, ttl=config.SESSION_CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl, on_evict=self._zero)
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def _key(account_id, ciphertext):
+        return str(account_id), hashlib.sha256(ciphertext.encode()).hexdigest()
+
+    @staticmethod
+    def _zero(key, buffer):
+        buffer[:] = bytes(len(buffer))
+
+    def get(self, account_id, ciphertext):
+        buffer = self._cache.get(self._key(account_id, ciphertext))
+        return buffer.decode() if buffer is not None else None
+
+    def put(self, account_id, ciphertext, plaintext):
+        self._cache.set(self._key(account_id, ciphertext), bytearray(plaintext.encode()))
+
+    def decrypt(self, account_id, ciphertext, cipher):
+        """Return the decrypted session, running cipher.decrypt only on a cache miss."""
+        plaintext = self.get(account_id, ciphertext)
+        if plaintext is None:
+            plaintext = cipher.decrypt(ciphertext.encode()).decode()
+            self.put(account_id, ciphertext, plaintext)
+        return plaintext
+
+    async def decrypt_async(self, account_id, ciphertext, cipher):
+        """Like decrypt(), but a cache miss is decrypted on the CPU executor."""
+        plaintext = self.get(account_id, ciphertext)
+        if plaintext is None:
+            plaintext = await cpu_executor.run("session_decrypt", decrypt_text, cipher, ciphertext)
+            self.put(account_id, ciphertext, plaintext)
+        return plaintext
+
+    def invalidate_account(self, account_id):
+        """Drop (and zero) every cached session for account_id."""
+        account_id = str(account_id)
+        self._cache.invalidate_where(lambda key, _: key[0] == account_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+# Process-wide cache shared by the account loader and the database invalidation hooks
+session_cache = SessionCache()
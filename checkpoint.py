@@ -0,0 +1,131 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+import config
+from broadcast_engine import message_id_of
+
+logger = logging.getLogger(__name__)
+
+
+def pair_key(group_id, message):
+    """Checkpoint key for one (group, message) delivery."""
+    return f"{group_id}:{message_id_of(message)}"
+
+
+class BroadcastCheckpoint:
+    """
+    Durable cursor for one user's in-flight broadcast cycle, stored on the
+    user's broadcast_states document (async collection) under `cursor`.
+
+    The cursor is the set of (group, message) pairs already attempted plus
+    running counters. record() only buffers; the buffer is written with a
+    single $addToSet/$inc update every flush_every results or flush_interval
+    seconds, so a crash re-sends at most one unflushed batch. complete() moves
+    the totals to `last_cycle` and clears the cursor, so the next cycle starts
+    fresh while an interrupted one resumes where it stopped.
+
+    The cursor records `cycle_id` (the ad rotation index) and is only resumed
+    by the same cycle within max_age seconds of its last write; anything else
+    is discarded so a stale cursor never makes a new cycle skip groups.
+    """
+
+    def __init__(self, collection, user_id, cycle_id=None, max_age=config.CHECKPOINT_MAX_AGE,
+                 flush_every=config.CHECKPOINT_FLUSH_EVERY, flush_interval=config.CHECKPOINT_FLUSH_INTERVAL):
+        self.collection = collection
+        self.user_id = user_id
+        self.cycle_id = cycle_id
+        self.max_age = max_age
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.done = set()
+        self.resumed = {'sent': 0, 'failed': 0}
+        self._keys = []
+        self._counts = {'sent': 0, 'failed': 0}
+        self._last_flush = time.monotonic()
+
+    async def load(self):
+        """Read the cursor left by an interrupted cycle. Returns the number of pairs it already covers."""
+        try:
+            doc = await self.collection.find_one({"user_id": self.user_id}, {"cursor": 1})
+        except Exception as e:
+            logger.error(f"Failed to load broadcast cursor for {self.user_id}: {e}")
+            return 0
+        cursor = (doc or {}).get("cursor") or {}
+        if cursor and not self._resumable(cursor):
+            logger.info(f"User {self.user_id} - discarding stale broadcast cursor (cycle {cursor.get('cycle_id')})")
+            await self.discard()
+            cursor = {}
+        self.done = set(cursor.get("done", []))
+        self.resumed = {'sent': cursor.get('sent', 0), 'failed': cursor.get('failed', 0)}
+        if self.done:
+            logger.info(f"User {self.user_id} - resuming broadcast, {len(self.done)} deliveries already done")
+        return len(self.done)
+
+    def _resumable(self, cursor):
+        updated_at = cursor.get("updated_at")
+        return (
+            cursor.get("cycle_id") == self.cycle_id
+            and updated_at is not None
+            and updated_at > datetime.utcnow() - timedelta(seconds=self.max_age)
+        )
+
+    async def discard(self):
+        """Drop the stored cursor without recording a finished cycle."""
+        try:
+            await self.collection.update_one({"user_id": self.user_id}, {"$unset": {"cursor": ""}})
+        except Exception as e:
+            logger.error(f"Failed to discard broadcast cursor for {self.user_id}: {e}")
+
+    def is_done(self, group_id, message):
+        return pair_key(group_id, message) in self.done
+
+    async def record(self, group_id, message, success):
+        """Mark one delivery attempted; flushes when the batch is full or old enough."""
+        key = pair_key(group_id, message)
+        self.done.add(key)
+        self._keys.append(key)
+        self._counts['sent' if success else 'failed'] += 1
+        if len(self._keys) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        """Write buffered results in one update."""
+        self._last_flush = time.monotonic()
+        if not self._keys:
+            return
+        keys, counts = self._keys, self._counts
+        self._keys, self._counts = [], {'sent': 0, 'failed': 0}
+        try:
+            await self.collection.update_one(
+                {"user_id": self.user_id},
+                {
+                    "$addToSet": {"cursor.done": {"$each": keys}},
+                    "$inc": {"cursor.sent": counts['sent'], "cursor.failed": counts['failed']},
+                    "$set": {"cursor.cycle_id": self.cycle_id, "cursor.updated_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+        except Exception as e:
+            # Keep the batch for the next flush; the in-memory done set is still authoritative
+            logger.error(f"Failed to checkpoint broadcast for {self.user_id}: {e}")
+            self._keys = keys + self._keys
+            for field, value in counts.items():
+                self._counts[field] += value
+
+    async def complete(self, summary):
+        """Finish the cycle: store its totals (including resumed work) and clear the cursor."""
+        self._keys, self._counts = [], {'sent': 0, 'failed': 0}
+        last_cycle = dict(summary)
+        last_cycle['sent'] += self.resumed['sent']
+        last_cycle['failed'] += self.resumed['failed']
+        last_cycle['finished_at'] = datetime.utcnow()
+        try:
+            await self.collection.update_one(
+                {"user_id": self.user_id},
+                {"$set": {"last_cycle": last_cycle}, "$unset": {"cursor": ""}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to close broadcast cursor for {self.user_id}: {e}")
+        return last_cycle
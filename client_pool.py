@@ -0,0 +1,158 @@
+import asyncio
+import inspect
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class _PoolEntry:
+    __slots__ = ("client", "refs", "last_used")
+
+    def __init__(self, client, last_used):
+        self.client = client
+        self.refs = 0
+        self.last_used = last_used
+
+
+class ClientPool:
+    """
+    Long-lived registry of started Pyrogram clients keyed by account _id.
+
+    Clients are started lazily on first acquire and kept warm between
+    broadcast cycles. Callers must pair every acquire() with a release();
+    clients with no references are health-checked and stopped once they
+    have been idle longer than idle_timeout.
+    """
+
+    def __init__(self, idle_timeout=config.CLIENT_IDLE_TIMEOUT,
+                 check_interval=config.CLIENT_HEALTH_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._entries = {}
+        self._start_locks = {}
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, acc_id):
+        return acc_id in self._entries
+
+    async def acquire(self, acc_id, factory):
+        """
+        Return a started client for acc_id, starting one via factory() if needed.
+        factory is a zero-argument callable (or coroutine function) returning an unstarted client.
+        """
+        self._ensure_reaper()
+        while True:
+            lock = self._start_locks.setdefault(acc_id, asyncio.Lock())
+            async with lock:
+                if self._start_locks.get(acc_id) is lock:
+                    return await self._acquire_locked(acc_id, factory)
+            # The lock was retired by eviction while we waited: take the current one
+
+    async def _acquire_locked(self, acc_id, factory):
+        """acquire() body; the caller holds the current start lock for acc_id."""
+        entry = self._entries.get(acc_id)
+        if entry is not None and not entry.client.is_connected:
+            logger.warning(f"Pooled client {acc_id} disconnected, restarting")
+            await self._stop_entry(acc_id)
+            entry = None
+
+        if entry is None:
+            client = factory()
+            if inspect.isawaitable(client):
+                client = await client
+            try:
+                await client.start()
+            except BaseException:
+                # Includes cancellation by a caller's timeout: don't leak a half-started client
+                try:
+                    await client.stop()
+                except Exception:
+                    pass
+                raise
+            entry = _PoolEntry(client, asyncio.get_running_loop().time())
+            self._entries[acc_id] = entry
+            logger.info(f"Started pooled client {acc_id} ({len(self._entries)} in pool)")
+
+        entry.refs += 1
+        entry.last_used = asyncio.get_running_loop().time()
+        return entry.client
+
+    def release(self, acc_id):
+        """Drop one reference to a pooled client; the client stays warm."""
+        entry = self._entries.get(acc_id)
+        if entry is None:
+            return
+        entry.refs = max(0, entry.refs - 1)
+        entry.last_used = asyncio.get_running_loop().time()
+
+    async def discard(self, acc_id):
+        """Stop and forget a client regardless of references (e.g. banned session)."""
+        await self._stop_entry(acc_id)
+        self._start_locks.pop(acc_id, None)
+
+    async def close(self):
+        """Stop every pooled client and the eviction task."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for acc_id in list(self._entries):
+            await self._stop_entry(acc_id)
+        self._start_locks.clear()
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_forever())
+
+    async def _reap_forever(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Client pool sweep failed: {e}")
+
+    async def evict_idle(self):
+        """Stop idle clients past idle_timeout and drop unhealthy idle ones."""
+        now = asyncio.get_running_loop().time()
+        for acc_id, entry in list(self._entries.items()):
+            if entry.refs > 0:
+                continue
+            # Holding the start lock keeps acquire() from handing the client out mid-check
+            async with self._start_locks.setdefault(acc_id, asyncio.Lock()):
+                if self._entries.get(acc_id) is not entry or entry.refs > 0:
+                    continue
+                if now - entry.last_used > self.idle_timeout:
+                    logger.info(f"Evicting idle pooled client {acc_id}")
+                else:
+                    if await self._is_healthy(entry.client):
+                        continue
+                    # Re-check: the entry may have been discarded or replaced during the check
+                    if self._entries.get(acc_id) is not entry or entry.refs > 0:
+                        continue
+                    logger.warning(f"Pooled client {acc_id} failed health check, evicting")
+                await self._stop_entry(acc_id)
+                # Retire the lock too; acquire() retries on the new one if it was waiting
+                self._start_locks.pop(acc_id, None)
+
+    async def _is_healthy(self, client):
+        if not client.is_connected:
+            return False
+        try:
+            await asyncio.wait_for(client.get_me(), timeout=10)
+            return True
+        except Exception:
+            return False
+
+    async def _stop_entry(self, acc_id):
+        entry = self._entries.pop(acc_id, None)
+        if entry is None:
+            return
+        try:
+            await entry.client.stop()
+        except Exception as e:
+            logger.debug(f"Error stopping pooled client {acc_id}: {e}")
@@ -1,4 +1,5 @@
 import os
+import socket
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7909863011:AAFH7skqKlsI1KJUVK-92NNkRPfVR5LFOFI")
 LOGGER_BOT_TOKEN = os.getenv("LOGGER_BOT_TOKEN", "8421844467:AAG5qrlh-371y1MQM9lEVlbdvhj4-ixXEs4")
@@ -69,9 +70,14 @@ MAX_DELAY = 3600
 OTP_LENGTH = 5
 OTP_EXPIRY = 300
 
-# Logging Configuration
-LOG_LEVEL = "INFO"
-LOG_FILE = "logs/BrutodAdsBot.log"
+# Logging Configuration (queued; a background thread does all file and console I/O)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = "logs/Brutod_bot.log"
+LOG_JSON = True  # JSON lines in LOG_FILE; the console stays plain text
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate the log file at 10 MB
+LOG_BACKUP_COUNT = 5  # Rotated files kept
+LOG_RATE_LIMIT = 20  # Records per call site per window below ERROR (extra ones are counted, not written)
+LOG_RATE_WINDOW = 60  # Seconds
 
 # Feature Toggles
 ENABLE_FORCE_JOIN = True
@@ -104,3 +110,88 @@ ERROR_MESSAGES = {
 
 # Session Storage
 SESSION_STORAGE_PATH = "sessions/"
+
+# Client Pool Settings
+CLIENT_IDLE_TIMEOUT = 900  # Stop pooled clients unused for 15 minutes
+CLIENT_HEALTH_CHECK_INTERVAL = 60  # Seconds between idle eviction / health sweeps
+CLIENT_START_CONCURRENCY = 5  # Accounts started in parallel per broadcast
+CLIENT_START_TIMEOUT = 30  # Seconds before a single account's startup is abandoned
+
+# Broadcast Engine Settings
+MAX_FLOOD_WAIT = 600  # Total FloodWait seconds an account may sit out per cycle before it stops
+
+# Rate Limiter Settings (AIMD pacing per account, fixed pacing per chat)
+RATE_LIMIT_DEFAULT_INTERVAL = 15  # Starting seconds between sends when no user delay is known
+RATE_LIMIT_MIN_INTERVAL = 10  # Fastest pace an account may reach (same bounds as utils.validate_delay)
+RATE_LIMIT_MAX_INTERVAL = 600  # Slowest pace an account backs off to
+RATE_LIMIT_CHAT_INTERVAL = 3  # Minimum seconds between sends into the same chat
+RATE_LIMIT_INCREASE_STEP = 0.002  # Sends/second added after each successful send
+RATE_LIMIT_DECREASE_FACTOR = 0.5  # Rate multiplier applied on every FloodWait
+RATE_LIMIT_JITTER = 2  # Max random seconds added to each wait
+RATE_LIMIT_IDLE_TTL = 2 * MAX_DELAY  # Seconds an unused account or chat bucket is kept (outlives the longest ad delay)
+RATE_LIMIT_MAX_ENTRIES = 100000  # Account plus chat buckets kept per limiter before the least recently used go
+
+# Temporary Data Expiry (enforced by MongoDB TTL indexes)
+TEMP_DATA_TTL = 1800  # temp_data rows expire 30 minutes after their last update
+USER_TEMP_DATA_TTL = 1800  # set_user_temp_data values expire after 30 minutes
+TEMP_BLACKLIST_DEFAULT_DURATION = 3600  # Assumed lifetime for legacy temp_blacklist rows without expires_at
+
+# Analytics Write Batching
+ANALYTICS_FLUSH_INTERVAL = 5  # Seconds between analytics bulk writes
+ANALYTICS_FLUSH_THRESHOLD = 500  # Flush early once this many increments are queued
+ANALYTICS_BUCKET_RETENTION = 90 * 24 * 3600  # Hourly analytics buckets are kept for 90 days
+
+# Admin Stats
+ADMIN_STATS_MAX_AGE = 300  # Seconds before cached admin stats are refreshed in the background
+
+# User Settings Cache
+USER_SETTINGS_CACHE_SIZE = 10000  # Users whose settings snapshot is kept in memory
+USER_SETTINGS_CACHE_TTL = 30  # Seconds a settings snapshot is trusted before reloading
+
+# Blacklist Index Cache
+BLACKLIST_CACHE_SIZE = 10000  # Users whose blacklist index is kept in memory
+BLACKLIST_CACHE_TTL = 60  # Seconds before an index is reloaded (picks up other processes' writes)
+
+# Decrypted Session Cache
+SESSION_CACHE_SIZE = 5000  # Decrypted sessions kept in memory
+SESSION_CACHE_TTL = 3600  # Seconds before a decrypted session is zeroed and dropped
+
+# Broadcast Scheduler
+SCHEDULER_WORKERS = 20  # Broadcast cycles run concurrently across all users
+SCHEDULER_MAX_READY = 100  # Due cycles queued for a worker before the dispatcher waits
+
+# Broadcast Checkpoints (resume interrupted cycles)
+CHECKPOINT_FLUSH_EVERY = 25  # Deliveries buffered before the cursor is written
+CHECKPOINT_FLUSH_INTERVAL = 10  # Max seconds between cursor writes while sending
+CHECKPOINT_MAX_AGE = 6 * 3600  # Cursors not written for this long are discarded instead of resumed
+
+# Sharded Workers (each process runs the users that hash to its shard)
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))  # This worker's shard, 0..WORKER_TOTAL-1
+WORKER_TOTAL = int(os.getenv("WORKER_TOTAL", "1"))  # Number of broadcast worker processes/nodes
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")  # Lease owner name, unique per process
+SHARD_VIRTUAL_NODES = 100  # Points per shard on the consistent hash ring
+SHARD_RESCAN_INTERVAL = 30  # Seconds between scans for newly started broadcasts in this shard
+LEASE_TTL = 90  # Seconds a user lease survives without a heartbeat
+LEASE_HEARTBEAT_INTERVAL = 30  # Seconds between lease renewals
+
+# CPU Offload (Fernet crypto and large BSON decodes run off the event loop)
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "thread")  # "thread", "process" or "inline"
+CPU_EXECUTOR_WORKERS = int(os.getenv("CPU_EXECUTOR_WORKERS", "4"))  # Pool size
+
+# Streaming Scans
+SCAN_BATCH_SIZE = 500  # Documents fetched per keyset page by iter_users / iter_all_user_accounts
+
+# Metrics Endpoint (Prometheus text format on /metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # Local only by default
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Worker shard N listens on METRICS_PORT + N
+
+# Database Startup
+DB_ENSURE_INDEXES_ON_START = os.getenv("DB_ENSURE_INDEXES_ON_START", "true").lower() == "true"  # Check indexes in a background thread at boot; set false once `python migrations.py ensure-indexes` runs per deploy
+
+# Dialog Crawler (builds target_groups from the accounts' joined chats)
+DIALOG_REFRESH_INTERVAL = 6 * 3600  # Seconds an account's crawled group list is reused before re-crawling
+DIALOG_PAGE_SIZE = 100  # Dialogs per messages.GetDialogs request (Telegram's maximum)
+DIALOG_PAGE_DELAY = 1  # Seconds between pages for one account
+DIALOG_CRAWL_CONCURRENCY = 3  # Accounts crawled at once per user
+DIALOG_REFRESH_CHECK_INTERVAL = 300  # Seconds between sweeps for users whose groups are due a refresh
@@ -1,9 +1,17 @@
 ﻿import sys
+import heapq
 import logging
+import threading
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Optional, TypedDict, Union
 import pymongo
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo.errors import BulkWriteError, OperationFailure
 import config
+from analytics import AnalyticsAggregator, hour_bucket, recent_buckets_since
+from cache import TTLCache, session_cache
+from logging_config import setup_logging
+from metrics import instrument_methods
 from bson.objectid import ObjectId
 import time
 import json
@@ -20,26 +28,187 @@ except Exception:
 os.makedirs("logs", exist_ok=True)
 
 # âœ… Logging setup - INFO only (clean logs)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/Brutod_bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# Records go through a queue; a listener thread does the file/stream I/O
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# MongoDB client options shared by the sync and async managers
+MONGO_CLIENT_OPTIONS = {
+    'serverSelectionTimeoutMS': 30000,
+    'connectTimeoutMS': 20000,
+    'socketTimeoutMS': 20000,
+    'retryWrites': True,
+    'retryReads': True,
+    'maxPoolSize': 50,
+    'minPoolSize': 10,
+    'maxIdleTimeMS': 10000,
+    'waitQueueTimeoutMS': 10000,
+    'tlsAllowInvalidCertificates': True,  # Added for potential SSL issues
+    'w': 'majority',  # Ensure write acknowledgment
+    'journal': True,  # Enable journaling for durability
+    'appName': 'BrutodBot'  # Custom app name for monitoring
+}
+
+@dataclass(frozen=True)
+class UserSettings:
+    """Snapshot of the per-user settings a broadcast cycle reads, with the getters' defaults."""
+    user_id: int
+    ad_delay: int = 300
+    group_msg_delay: int = 15
+    cycle_timeout: int = 600
+    saved_messages_count: int = 3
+    ad_cycle_index: int = 0
+    api_id: Optional[int] = None
+    api_hash: Optional[str] = None
+    running: bool = False
+    paused: bool = False
+
+    @classmethod
+    def from_rows(cls, user_id, rows):
+        """Build a snapshot from the tagged rows returned by user_settings_pipeline()."""
+        fields = {}
+        for row in rows:
+            source = row.pop("src")
+            if source == "ad_delays":
+                row = {"ad_delay": row.get("delay")}
+            elif source == "group_msg_delays":
+                row = {"group_msg_delay": row.get("delay")}
+            elif source == "cycle_timeouts":
+                row = {"cycle_timeout": row.get("timeout")}
+            fields.update({k: v for k, v in row.items() if v is not None})
+        return cls(user_id=user_id, **fields)
+
+# Lightweight views of a users document. Reads project only the declared
+# fields (plus _id), so hot lookups skip saved_messages and other bulk.
+
+class UserStatusView(TypedDict, total=False):
+    _id: ObjectId
+    user_type: str
+    accounts_limit: Union[int, str]
+    premium_until: Optional[datetime]
+
+class UserCredentialsView(TypedDict, total=False):
+    _id: ObjectId
+    api_id: int
+    api_hash: str
+
+def view_fields(view):
+    """Field names declared by a view, usable as get_user(fields=...)."""
+    return list(view.__annotations__)
+
+def fields_projection(fields):
+    """find() projection for a list of field names (None means the whole document)."""
+    return None if fields is None else {field: 1 for field in fields}
+
+def user_settings_pipeline(user_id):
+    """
+    One aggregation over users that $unionWith's every settings collection for user_id.
+    Each row is tagged with its source collection in `src`.
+    """
+    def tagged(source, fields):
+        projection = {"_id": 0, "src": {"$literal": source}}
+        projection.update({field: 1 for field in fields})
+        return [{"$match": {"user_id": user_id}}, {"$project": projection}]
+
+    pipeline = tagged("users", ["api_id", "api_hash", "saved_messages_count", "ad_cycle_index"])
+    for source, fields in (
+        ("ad_delays", ["delay"]),
+        ("group_msg_delays", ["delay"]),
+        ("cycle_timeouts", ["timeout"]),
+        ("broadcast_states", ["running", "paused"]),
+    ):
+        pipeline.append({"$unionWith": {"coll": source, "pipeline": tagged(source, fields)}})
+    return pipeline
+
+def keyset_page_args(query, projection, after_id):
+    """Filter and projection for the next _id-ordered page after after_id (None for the first page)."""
+    page_query = dict(query or {})
+    if after_id is not None:
+        bound = {"_id": {"$gt": after_id}}
+        page_query = {"$and": [page_query, bound]} if page_query else bound
+    if projection is not None:
+        if not isinstance(projection, dict):
+            projection = {field: 1 for field in projection}
+        # The page cursor needs _id even if the caller does not
+        projection = dict(projection, _id=1)
+    return page_query, projection
+
+def iter_keyset(collection, query=None, projection=None, batch_size=config.SCAN_BATCH_SIZE):
+    """
+    Yield every document matching query in _id order, fetching batch_size at a time.
+    Each page is its own indexed range query, so memory stays constant and
+    there is no skip() cost or long-lived cursor to time out.
+    """
+    after_id = None
+    while True:
+        page_query, page_projection = keyset_page_args(query, projection, after_id)
+        batch = list(collection.find(page_query, page_projection).sort("_id", 1).limit(batch_size))
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        after_id = batch[-1]["_id"]
+
+class UserBlacklistIndex:
+    """In-memory blacklist for one user: a set of permanent groups plus an expiry heap for temporary ones."""
+
+    def __init__(self):
+        self.permanent = set()
+        self.temp_expiry = {}  # group_id -> expires_at
+        self._heap = []  # (expires_at, group_id), may hold superseded entries
+        self.lock = threading.Lock()
+
+    def add_permanent(self, group_id):
+        with self.lock:
+            self.permanent.add(group_id)
+
+    def add_temp(self, group_id, expires_at):
+        with self.lock:
+            self.temp_expiry[group_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, group_id))
+
+    def evict_expired(self, now):
+        """Drop every temporary entry that expired by `now` and return their group ids."""
+        expired = []
+        with self.lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, group_id = heapq.heappop(self._heap)
+                # Skip heap entries superseded by a later add_temp for the same group
+                if self.temp_expiry.get(group_id) == expires_at:
+                    del self.temp_expiry[group_id]
+                    expired.append(group_id)
+        return expired
+
+    def is_permanent(self, group_id):
+        return group_id in self.permanent
+
+    def is_temp(self, group_id):
+        return group_id in self.temp_expiry
+
+    def filter(self, group_ids):
+        """Return the group ids that are not blacklisted, preserving order."""
+        with self.lock:
+            return [gid for gid in group_ids if gid not in self.permanent and gid not in self.temp_expiry]
+
 class EnhancedDatabaseManager:
     def __init__(self):
         self.client = None
         self.db = None
-        self._init_db()  # ðŸš€ CRITICAL FIX: Initialize database connection on creation
+        # user_id -> UserBlacklistIndex; reloaded after the TTL so writes from other processes show up
+        self._blacklist_indexes = TTLCache(maxsize=config.BLACKLIST_CACHE_SIZE, ttl=config.BLACKLIST_CACHE_TTL)
+        self._blacklist_lock = threading.Lock()
+        self._admin_stats = None  # Last materialized admin_stats document
+        self._admin_stats_refreshing = threading.Event()
+        # user_id -> UserSettings; setters below invalidate their user's entry
+        self.settings_cache = TTLCache(maxsize=config.USER_SETTINGS_CACHE_SIZE, ttl=config.USER_SETTINGS_CACHE_TTL)
+        self._init_db()  # Lazy: no network I/O until the first query
         # Initialize collections after database connection
-        self.users = self.db.users if self.db is not None else None
-        self.accounts = self.db.accounts if self.db is not None else None
-        self.premium_users = self.db.premium_users if self.db is not None else None
-        self._load_persistent_globals()
+        self.users = self.db.users
+        self.accounts = self.db.accounts
+        self.premium_users = self.db.premium_users
+        # Per-message analytics counters are coalesced in memory and bulk-written
+        self.analytics_writer = AnalyticsAggregator(lambda name: self.db[name])
+        if config.DB_ENSURE_INDEXES_ON_START:
+            self._ensure_indexes_in_background()
 
     def add_temp_blacklist(self, user_id, group_id, reason="FloodWait", duration=3600):
         """Temporarily blacklist a group for a specific user."""
@@ -58,6 +227,9 @@ class EnhancedDatabaseManager:
                 },
                 upsert=True
             )
+            index = self._blacklist_indexes.get(user_id)
+            if index is not None:
+                index.add_temp(group_id, expires_at)
             logger.info(f"ðŸ•’ Group {group_id} temporarily blacklisted for user {user_id} ({reason}, {duration}s)")
         except Exception as e:
             logger.error(f"âŒ Failed to add temp blacklist for group {group_id}: {e}")
@@ -65,13 +237,7 @@ class EnhancedDatabaseManager:
     def is_temp_blacklisted(self, user_id, group_id):
         """Check if a group is temporarily blacklisted."""
         try:
-            doc = self.db.temp_blacklist.find_one({"user_id": user_id, "group_id": group_id})
-            if not doc:
-                return False
-            if datetime.utcnow() > doc.get("expires_at", datetime.utcnow()):
-                self.db.temp_blacklist.delete_one({"_id": doc["_id"]})  # Cleanup expired entries
-                return False
-            return True
+            return self._get_blacklist_index(user_id).is_temp(group_id)
         except Exception as e:
             logger.error(f"Failed to check temp blacklist for {group_id}: {e}")
             return False
@@ -94,6 +260,9 @@ class EnhancedDatabaseManager:
             },
             upsert=True
         )
+        index = self._blacklist_indexes.get(user_id)
+        if index is not None:
+            index.add_permanent(group_id)
 
     def get_blacklisted_groups(self, user_id):
         """Get all blacklisted groups for a user"""
@@ -101,143 +270,165 @@ class EnhancedDatabaseManager:
 
     def is_group_blacklisted(self, user_id, group_id):
         """Check if a group is blacklisted for a user"""
-        return self.db.blacklisted_groups.find_one({
-            'user_id': user_id,
-            'group_id': group_id
-        }) is not None
+        return self._get_blacklist_index(user_id).is_permanent(group_id)
+
+    def filter_blacklisted_groups(self, user_id, target_groups):
+        """
+        Drop permanently and temporarily blacklisted groups from target_groups.
+        Accepts target_groups documents or raw group ids and preserves order.
+        """
+        try:
+            index = self._get_blacklist_index(user_id)
+            group_ids = [g['group_id'] if isinstance(g, dict) else g for g in target_groups]
+            allowed = set(index.filter(group_ids))
+            return [g for g, gid in zip(target_groups, group_ids) if gid in allowed]
+        except Exception as e:
+            logger.error(f"Failed to filter blacklisted groups for {user_id}: {e}")
+            return list(target_groups)
+
+    def _get_blacklist_index(self, user_id):
+        """Return the user's blacklist index, (re)loading it with one query when it is missing or stale."""
+        index = self._blacklist_indexes.get(user_id)
+        if index is None:
+            with self._blacklist_lock:
+                index = self._blacklist_indexes.get(user_id)
+                if index is None:
+                    index = self._load_blacklist_index(user_id)
+                    self._blacklist_indexes.set(user_id, index)
+        self._evict_expired_blacklist(user_id, index)
+        return index
+
+    def _load_blacklist_index(self, user_id):
+        """Load permanent and live temporary blacklist entries in a single aggregation."""
+        now = datetime.utcnow()
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$project": {"_id": 0, "group_id": 1, "expires_at": {"$literal": None}}},
+            {"$unionWith": {
+                "coll": "temp_blacklist",
+                "pipeline": [
+                    {"$match": {"user_id": user_id, "expires_at": {"$gt": now}}},
+                    {"$project": {"_id": 0, "group_id": 1, "expires_at": 1}}
+                ]
+            }}
+        ]
+        index = UserBlacklistIndex()
+        for doc in self.db.blacklisted_groups.aggregate(pipeline):
+            if doc.get("expires_at") is None:
+                index.add_permanent(doc["group_id"])
+            else:
+                index.add_temp(doc["group_id"], doc["expires_at"])
+        return index
+
+    def _evict_expired_blacklist(self, user_id, index):
+        """Evict expired temp entries from the index (the expires_at TTL index removes the rows)."""
+        index.evict_expired(datetime.utcnow())
 
     def _init_db(self):
-        """Initialize MongoDB connection with exponential backoff retries and robust index handling."""
-        max_retries = 5
-        retry_delay = 2
-        last_error = None
-
-        # MongoDB client options with improved settings for better reliability
-        client_options = {
-            'serverSelectionTimeoutMS': 30000,
-            'connectTimeoutMS': 20000,
-            'socketTimeoutMS': 20000,
-            'retryWrites': True,
-            'retryReads': True,
-            'maxPoolSize': 50,
-            'minPoolSize': 10,
-            'maxIdleTimeMS': 10000,
-            'waitQueueTimeoutMS': 10000,
-            'tlsAllowInvalidCertificates': True,  # Added for potential SSL issues
-            'w': 'majority',  # Ensure write acknowledgment
-            'journal': True,  # Enable journaling for durability
-            'appName': 'BrutodBot'  # Custom app name for monitoring
-        }
-
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"MongoDB connection attempt {attempt + 1}/{max_retries}")
-                
-                # Parse connection string to extract host and port
-                if "mongodb+srv://" in config.MONGO_URI:
-                    logger.info("Using MongoDB Atlas connection string")
-                else:
-                    logger.info("Using standard MongoDB connection string")
-                
-                self.client = pymongo.MongoClient(config.MONGO_URI, **client_options)
-                
-                # Test connection with increased timeout
-                self.client.admin.command("ping", socketTimeoutMS=10000)
-                logger.info("MongoDB server ping successful")
-                
-                self.db = self.client[config.DB_NAME]
-                logger.info(f"Connected to database: {config.DB_NAME}")
-                
-                # Test database access
-                collections = self.db.list_collection_names()
-                logger.info(f"Database access verified - Collections: {collections}")
-                
-                # Helper to safely create or verify indexes
-                def ensure_index(collection, key, **kwargs):
-                    index_key = key if isinstance(key, list) else [(key, pymongo.ASCENDING)]
-                    index_name = "_".join(f"{k}_{v}" for k, v in index_key)
-                    index_retry_delay = 1
-                    for index_attempt in range(3):
-                        try:
-                            existing_indexes = collection.index_information()
-                            if index_name in existing_indexes:
-                                existing_unique = existing_indexes[index_name].get("unique", False)
-                                desired_unique = kwargs.get("unique", False)
-                                if existing_unique != desired_unique:
-                                    collection.drop_index(index_name)
-                                    logger.info(f"Dropped conflicting index {index_name} on {collection.name}")
-                                else:
-                                    logger.info(f"Index {index_name} on {collection.name} already exists with correct specs")
-                                    return
-                            collection.create_index(key, name=index_name, **kwargs)
-                            logger.info(f"Created index {index_name} on {collection.name}")
-                            return
-                        except OperationFailure as e:
-                            logger.error(f"Failed to create index {index_name} on {collection.name} (attempt {index_attempt + 1}): {e}")
-                            if index_attempt < 2:
-                                time.sleep(index_retry_delay)
-                                index_retry_delay *= 2
+        """
+        Create the MongoDB client without touching the network. pymongo connects
+        on the first operation (retrying server selection for up to
+        serverSelectionTimeoutMS), so constructing the manager is instant.
+        Indexes are handled by ensure_indexes(), not on every boot.
+        """
+        logger.info(f"Using {'MongoDB Atlas' if 'mongodb+srv://' in config.MONGO_URI else 'standard MongoDB'} connection string, database {config.DB_NAME}")
+        self.client = pymongo.MongoClient(config.MONGO_URI, connect=False, **MONGO_CLIENT_OPTIONS)
+        self.db = self.client[config.DB_NAME]
+
+    def ensure_indexes(self):
+        """
+        Create or fix every index the bot relies on (including the TTL indexes).
+        Idempotent; run it once per deploy with `python migrations.py ensure-indexes`,
+        or let DB_ENSURE_INDEXES_ON_START run it in a background thread.
+        """
+        try:
+            # Helper to safely create or verify indexes
+            def ensure_index(collection, key, **kwargs):
+                index_key = key if isinstance(key, list) else [(key, pymongo.ASCENDING)]
+                index_name = "_".join(f"{k}_{v}" for k, v in index_key)
+                index_retry_delay = 1
+                for index_attempt in range(3):
+                    try:
+                        existing_indexes = collection.index_information()
+                        if index_name in existing_indexes:
+                            existing_unique = existing_indexes[index_name].get("unique", False)
+                            desired_unique = kwargs.get("unique", False)
+                            existing_ttl = existing_indexes[index_name].get("expireAfterSeconds")
+                            desired_ttl = kwargs.get("expireAfterSeconds")
+                            if existing_unique != desired_unique or existing_ttl != desired_ttl:
+                                collection.drop_index(index_name)
+                                logger.info(f"Dropped conflicting index {index_name} on {collection.name}")
                             else:
-                                raise
-
-                # âœ… Create necessary indexes
-                ensure_index(self.db.users, "user_id", unique=True)
-                ensure_index(self.db.accounts, [("user_id", pymongo.ASCENDING), ("phone_number", pymongo.ASCENDING)])
-                ensure_index(self.db.ad_messages, "user_id")
-                ensure_index(self.db.ad_delays, "user_id", unique=True)
-                ensure_index(self.db.broadcast_states, "user_id", unique=True)
-                ensure_index(self.db.target_groups, [("user_id", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING)])
-                ensure_index(self.db.analytics, "user_id", unique=True)
-                ensure_index(self.db.broadcast_logs, "user_id")
-                ensure_index(self.db.broadcast_activity, "user_id")
-                ensure_index(self.db.temp_data, [("user_id", pymongo.ASCENDING), ("key", pymongo.ASCENDING)], unique=True)
-                ensure_index(self.db.logger_status, "user_id", unique=True)
-                ensure_index(self.db.logger_failures, "user_id")
-                ensure_index(self.db.premium_users, "user_id", unique=True)
+                                logger.info(f"Index {index_name} on {collection.name} already exists with correct specs")
+                                return
+                        collection.create_index(key, name=index_name, **kwargs)
+                        logger.info(f"Created index {index_name} on {collection.name}")
+                        return
+                    except OperationFailure as e:
+                        logger.error(f"Failed to create index {index_name} on {collection.name} (attempt {index_attempt + 1}): {e}")
+                        if index_attempt < 2:
+                            time.sleep(index_retry_delay)
+                            index_retry_delay *= 2
+                        else:
+                            raise
+
+            # âœ… Create necessary indexes
+            ensure_index(self.db.users, "user_id", unique=True)
+            ensure_index(self.db.accounts, [("user_id", pymongo.ASCENDING), ("phone_number", pymongo.ASCENDING)])
+            ensure_index(self.db.ad_messages, "user_id")
+            ensure_index(self.db.ad_delays, "user_id", unique=True)
+            ensure_index(self.db.broadcast_states, "user_id", unique=True)
+            ensure_index(self.db.target_groups, [("user_id", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING)])
+            ensure_index(self.db.analytics, "user_id", unique=True)
+            ensure_index(self.db.broadcast_logs, "user_id")
+            ensure_index(self.db.broadcast_activity, "user_id")
+            ensure_index(self.db.temp_data, [("user_id", pymongo.ASCENDING), ("key", pymongo.ASCENDING)], unique=True)
+            ensure_index(self.db.logger_status, "user_id", unique=True)
+            ensure_index(self.db.logger_failures, "user_id")
+            ensure_index(self.db.premium_users, "user_id", unique=True)
 # Auto-reply indexes removed
-                
-                # ðŸ†• Ensure group_msg_delays collection has index
-                ensure_index(self.db.group_msg_delays, "user_id", unique=True)
-
-                # ðŸ†• Ensure ad_pointers index for rotation pointer (one-per-user)
-                ensure_index(self.db.ad_pointers, "user_id", unique=True)
-                
-                logger.info("âœ… All database indexes ensured successfully")
-                return
-
-            except ConnectionFailure as e:
-                logger.error(f"MongoDB connection attempt {attempt + 1}/{max_retries} failed: {e}")
-                last_error = e
-                if attempt < max_retries - 1:
-                    logger.info(f"Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    logger.error("Max retries reached for MongoDB connection. Check MONGO_URI in config.py.")
-                    raise last_error
-            except OperationFailure as e:
-                logger.error(f"Failed to initialize MongoDB: {e}. Ensure MONGO_URI credentials and database name are correct.")
-                if "bad auth" in str(e).lower():
-                    logger.error("Authentication failed. Verify username, password, and database name in MONGO_URI.")
-                raise
-            except Exception as e:
-                logger.error(f"Unexpected error during MongoDB init: {e}")
-                raise
-
-    def _load_persistent_globals(self):
-        """Load persistent user data like ad messages, delays, broadcast states from DB."""
-        try:
-            # Test if collections exist and are accessible
-            collections_to_check = ['ad_messages', 'ad_delays', 'broadcast_states', 'logger_status']
-            for collection_name in collections_to_check:
-                if hasattr(self.db, collection_name):
-                    count = getattr(self.db, collection_name).count_documents({})
-                    logger.info(f"âœ… {collection_name}: {count} documents")
-                else:
-                    logger.warning(f"âš ï¸ Collection {collection_name} not found")
-                    
+            
+            # ðŸ†• Ensure group_msg_delays collection has index
+            ensure_index(self.db.group_msg_delays, "user_id", unique=True)
+
+            # ðŸ†• Ensure ad_pointers index for rotation pointer (one-per-user)
+            ensure_index(self.db.ad_pointers, "user_id", unique=True)
+
+            # TTL indexes: MongoDB deletes expired temp rows, reads never clean up
+            ensure_index(self.db.temp_blacklist, "expires_at", expireAfterSeconds=0)
+            ensure_index(self.db.temp_data, "updated_at", expireAfterSeconds=config.TEMP_DATA_TTL)
+            ensure_index(self.db.user_temp_data, [("user_id", pymongo.ASCENDING), ("key", pymongo.ASCENDING)], unique=True)
+            ensure_index(self.db.user_temp_data, "timestamp", expireAfterSeconds=config.USER_TEMP_DATA_TTL)
+
+            # Hourly analytics buckets: one row per (user, account, group, hour)
+            ensure_index(self.db.analytics_buckets, [
+                ("user_id", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING),
+                ("account_id", pymongo.ASCENDING), ("group_id", pymongo.ASCENDING)
+            ], unique=True)
+            ensure_index(self.db.analytics_buckets, "bucket", expireAfterSeconds=config.ANALYTICS_BUCKET_RETENTION)
+
+            # Dialog crawler: one cache/checkpoint document per account
+            ensure_index(self.db.dialog_cache, "account_id", unique=True)
+            ensure_index(self.db.dialog_cache, "user_id")
+            
+            logger.info("âœ… All database indexes ensured successfully")
+        except OperationFailure as e:
+            logger.error(f"Failed to ensure indexes: {e}")
+            if "bad auth" in str(e).lower():
+                logger.error("Authentication failed. Verify username, password, and database name in MONGO_URI.")
+            raise
         except Exception as e:
-            logger.error(f"Failed to load persistent globals: {e}")
+            logger.error(f"Unexpected error while ensuring indexes: {e}")
+            raise
+
+    def _ensure_indexes_in_background(self):
+        def run():
+            try:
+                self.ensure_indexes()
+            except Exception:
+                pass  # Already logged; the bot keeps serving without the missing indexes
+
+        threading.Thread(target=run, name="ensure-indexes", daemon=True).start()
 
     # ================= USER MANAGEMENT =================
 
@@ -268,10 +459,10 @@ class EnhancedDatabaseManager:
             logger.error(f"Failed to create user {user_id}: {e}")
             raise
 
-    def get_user(self, user_id):
-        """Fetch user data."""
+    def get_user(self, user_id, fields=None):
+        """Fetch user data, optionally only `fields` (e.g. view_fields(UserStatusView)) plus _id."""
         try:
-            user = self.db.users.find_one({"user_id": user_id})
+            user = self.db.users.find_one({"user_id": user_id}, fields_projection(fields))
             return user if user else None
         except Exception as e:
             logger.error(f"Failed to get user {user_id}: {e}")
@@ -346,6 +537,10 @@ class EnhancedDatabaseManager:
             logger.error(f"Failed to fetch all user accounts: {e}")
             return []
 
+    def iter_all_user_accounts(self, query=None, projection=None, batch_size=config.SCAN_BATCH_SIZE):
+        """Stream all accounts (optionally filtered/projected) in _id order with constant memory."""
+        return iter_keyset(self.db.accounts, query, projection, batch_size)
+
     def get_user_accounts_count(self, user_id):
         """Count user's accounts."""
         try:
@@ -357,7 +552,7 @@ class EnhancedDatabaseManager:
     def add_user_account(self, user_id, phone_number, session_string, **kwargs):
         """Add a user account with dynamic limit enforcement."""
         try:
-            user = self.get_user(user_id)
+            user = self.get_user(user_id, ["accounts_limit"])
             if not user:
                 logger.warning(f"User {user_id} not found")
                 return False
@@ -398,6 +593,7 @@ class EnhancedDatabaseManager:
         """Delete a user account by user_id and account_id."""
         try:
             result = self.db.accounts.delete_one({"user_id": user_id, "_id": ObjectId(account_id)})
+            session_cache.invalidate_account(account_id)
             if result.deleted_count > 0:
                 logger.info(f"Account {account_id} deleted for user {user_id}")
                 return True
@@ -411,7 +607,10 @@ class EnhancedDatabaseManager:
     def delete_all_user_accounts(self, user_id):
         """Delete all accounts for a user."""
         try:
+            account_ids = [doc["_id"] for doc in self.db.accounts.find({"user_id": user_id}, {"_id": 1})]
             result = self.db.accounts.delete_many({"user_id": user_id})
+            for account_id in account_ids:
+                session_cache.invalidate_account(account_id)
             deleted_count = result.deleted_count
             logger.info(f"Deleted {deleted_count} accounts for user {user_id}")
             return deleted_count
@@ -426,6 +625,7 @@ class EnhancedDatabaseManager:
                 {"_id": ObjectId(account_id)},
                 {"$set": {"is_active": False, "updated_at": datetime.utcnow()}}
             )
+            session_cache.invalidate_account(account_id)
             logger.info(f"Deactivated account {account_id}")
         except Exception as e:
             logger.error(f"Failed to deactivate account {account_id}: {e}")
@@ -438,25 +638,34 @@ class EnhancedDatabaseManager:
 
     # OLD AD MESSAGE FUNCTIONS REMOVED - NOW USING SAVED MESSAGES SYSTEM
 
+    # ================= USER SETTINGS SNAPSHOT =================
+
+    def get_user_settings(self, user_id):
+        """
+        Return the user's UserSettings snapshot, loading every settings collection
+        in one aggregation on a cache miss. Setters invalidate the cached entry.
+        """
+        settings = self.settings_cache.get(user_id)
+        if settings is not None:
+            return settings
+        try:
+            rows = list(self.db.users.aggregate(user_settings_pipeline(user_id)))
+            settings = UserSettings.from_rows(user_id, rows)
+            self.settings_cache.set(user_id, settings)
+            return settings
+        except Exception as e:
+            logger.error(f"Failed to load settings for {user_id}: {e}")
+            return UserSettings(user_id=user_id)
+
     # ================= AD DELAY MANAGEMENT =================
 
     def get_user_ad_delay(self, user_id):
         """Get user's ad delay."""
-        try:
-            doc = self.db.ad_delays.find_one({"user_id": user_id}, {"delay": 1})
-            return doc.get("delay", 300) if doc else 300
-        except Exception as e:
-            logger.error(f"Failed to get ad delay for {user_id}: {e}")
-            return 300
+        return self.get_user_settings(user_id).ad_delay
             
     def get_user_group_msg_delay(self, user_id):
         """Get user's group message delay. Default is 15 seconds."""
-        try:
-            doc = self.db.group_msg_delays.find_one({"user_id": user_id}, {"delay": 1})
-            return doc.get("delay", 15) if doc else 15  # Default to 15 seconds
-        except Exception as e:
-            logger.error(f"Failed to get group message delay for {user_id}: {e}")
-            return 15  # Default to 15 seconds
+        return self.get_user_settings(user_id).group_msg_delay
             
     def set_user_group_msg_delay(self, user_id, delay):
         """Set user's group message delay."""
@@ -466,6 +675,7 @@ class EnhancedDatabaseManager:
                 {"$set": {"delay": delay, "updated_at": datetime.utcnow()}},
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Group msg delay set to {delay}s for user {user_id}")
         except Exception as e:
             logger.error(f"Failed to set group msg delay for {user_id}: {e}")
@@ -475,12 +685,7 @@ class EnhancedDatabaseManager:
 
     def get_user_cycle_timeout(self, user_id):
         """Get user's cycle timeout in seconds. Default: 10 minutes (600s)."""
-        try:
-            doc = self.db.cycle_timeouts.find_one({"user_id": user_id}, {"timeout": 1})
-            return doc.get("timeout", 600) if doc else 600
-        except Exception as e:
-            logger.error(f"Failed to get cycle timeout for {user_id}: {e}")
-            return 600
+        return self.get_user_settings(user_id).cycle_timeout
 
     def set_user_cycle_timeout(self, user_id, timeout):
         """Set user's cycle timeout in seconds."""
@@ -493,6 +698,7 @@ class EnhancedDatabaseManager:
                 }},
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Cycle timeout set to {timeout}s for user {user_id}")
         except Exception as e:
             logger.error(f"Failed to set cycle timeout for {user_id}: {e}")
@@ -500,12 +706,7 @@ class EnhancedDatabaseManager:
 
     def get_user_saved_messages_count(self, user_id):
         """Get the number of saved messages to use for rotation"""
-        try:
-            user = self.db.users.find_one({"user_id": user_id}, {"saved_messages_count": 1})
-            return user.get("saved_messages_count", 3) if user else 3  # Default to 3 messages
-        except Exception as e:
-            logger.error(f"Failed to get saved messages count for {user_id}: {e}")
-            return 3
+        return self.get_user_settings(user_id).saved_messages_count
     
     def reset_ad_cycle(self, user_id):
         """Reset ad cycle index to 0 (start from first message)"""
@@ -515,6 +716,7 @@ class EnhancedDatabaseManager:
                 {"$set": {"ad_cycle_index": 0}},
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Reset ad cycle to 0 for user {user_id}")
             return True
         except Exception as e:
@@ -534,6 +736,7 @@ class EnhancedDatabaseManager:
                 },
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Saved messages count set to {count} for user {user_id}")
             return True
         except Exception as e:
@@ -549,6 +752,7 @@ class EnhancedDatabaseManager:
                 {"$set": {"delay": delay, "updated_at": datetime.utcnow()}},
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Ad delay set for {user_id}: {delay}s")
         except Exception as e:
             logger.error(f"Failed to set ad delay for {user_id}: {e}")
@@ -558,43 +762,62 @@ class EnhancedDatabaseManager:
 
     def get_broadcast_state(self, user_id):
         """Get user's broadcast state."""
-        try:
-            doc = self.db.broadcast_states.find_one({"user_id": user_id}, {"running": 1, "paused": 1})
-            return doc if doc else {"running": False, "paused": False}
-        except Exception as e:
-            logger.error(f"Failed to get broadcast state for {user_id}: {e}")
-            return {"running": False, "paused": False}
+        settings = self.get_user_settings(user_id)
+        return {"running": settings.running, "paused": settings.paused}
 
     def set_broadcast_state(self, user_id, running=False, paused=False):
-        """Set user's broadcast state."""
+        """Set user's broadcast state. Stopping or (re)starting also drops any in-flight cycle cursor."""
         try:
+            # Pausing or resuming a running broadcast keeps the cursor so the cycle can pick up where it was
+            keep_cursor = {"$cond": [{"$eq": ["$running", True]}, "$cursor", "$$REMOVE"]} if running else "$$REMOVE"
             self.db.broadcast_states.update_one(
                 {"user_id": user_id},
-                {"$set": {"running": running, "paused": paused, "updated_at": datetime.utcnow()}},
+                [{"$set": {
+                    "running": running,
+                    "paused": paused,
+                    "updated_at": datetime.utcnow(),
+                    "cursor": keep_cursor
+                }}],
                 upsert=True
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"Broadcast state updated for {user_id}: running={running}, paused={paused}")
         except Exception as e:
             logger.error(f"Failed to set broadcast state for {user_id}: {e}")
             raise
 
+    def get_broadcast_progress(self, user_id):
+        """Totals of the last finished cycle and the size of any in-flight cursor."""
+        try:
+            doc = self.db.broadcast_states.find_one(
+                {"user_id": user_id},
+                {"_id": 0, "last_cycle": 1, "cursor.sent": 1, "cursor.failed": 1, "cursor.updated_at": 1}
+            ) or {}
+            return {"last_cycle": doc.get("last_cycle"), "in_progress": doc.get("cursor")}
+        except Exception as e:
+            logger.error(f"Failed to get broadcast progress for {user_id}: {e}")
+            return {"last_cycle": None, "in_progress": None}
+
+    def get_running_broadcast_users(self):
+        """User IDs whose broadcast is running and not paused (used to seed the scheduler)."""
+        try:
+            cursor = self.db.broadcast_states.find({"running": True, "paused": {"$ne": True}}, {"user_id": 1, "_id": 0})
+            return [doc["user_id"] for doc in cursor]
+        except Exception as e:
+            logger.error(f"Failed to get running broadcasts: {e}")
+            return []
+
     def increment_broadcast_cycle(self, user_id):
         """Increment the broadcast cycle count for a user and update cycle index for message rotation."""
         try:
-            # Increment analytics
-            self.db.analytics.update_one(
-                {"user_id": user_id},
-                {
-                    "$inc": {"total_cycles": 1},
-                    "$set": {"updated_at": datetime.utcnow()}
-                },
-                upsert=True
-            )
+            # Increment analytics (flushed with the other counters in the writer's next bulk_write)
+            self.analytics_writer.increment({"user_id": user_id}, {"total_cycles": 1})
             
             # Also update the cycle index for message rotation
-            self.update_ad_cycle(user_id)
+            next_cycle = self.update_ad_cycle(user_id)
             
-            logger.info(f"Incremented broadcast cycle for user {user_id}")
+            logger.debug(f"Incremented broadcast cycle for user {user_id}")
+            return next_cycle
         except Exception as e:
             logger.error(f"Failed to increment broadcast cycle for {user_id}: {e}")
             raise
@@ -628,12 +851,75 @@ class EnhancedDatabaseManager:
             logger.error(f"Failed to add target group for {user_id}: {e}")
             raise
 
+    def sync_target_groups(self, user_id, dialogs, remove_missing=True):
+        """
+        Make target_groups match `dialogs` ({"group_id", "group_name"} dicts or
+        (group_id, group_name) pairs) with one read and one unordered bulk_write.
+        New groups are added, renamed ones updated and, with remove_missing,
+        groups no longer in dialogs deleted. Returns the diff summary.
+        """
+        summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "errors": 0}
+        try:
+            wanted = {}
+            for dialog in dialogs:
+                group_id, group_name = (dialog["group_id"], dialog.get("group_name")) if isinstance(dialog, dict) else dialog
+                wanted[group_id] = group_name
+
+            existing = {
+                doc["group_id"]: doc.get("group_name")
+                for doc in self.db.target_groups.find({"user_id": user_id}, {"_id": 0, "group_id": 1, "group_name": 1})
+            }
+
+            now = datetime.utcnow()
+            ops = []
+            for group_id, group_name in wanted.items():
+                if group_id not in existing:
+                    # Upsert rather than insert: (user_id, group_id) is not a unique index
+                    ops.append(pymongo.UpdateOne(
+                        {"user_id": user_id, "group_id": group_id},
+                        {"$set": {"group_name": group_name, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                        upsert=True
+                    ))
+                    summary["added"] += 1
+                elif existing[group_id] != group_name:
+                    ops.append(pymongo.UpdateOne(
+                        {"user_id": user_id, "group_id": group_id},
+                        {"$set": {"group_name": group_name, "updated_at": now}}
+                    ))
+                    summary["updated"] += 1
+                else:
+                    summary["unchanged"] += 1
+
+            missing = [group_id for group_id in existing if group_id not in wanted] if remove_missing else []
+            if missing:
+                ops.append(pymongo.DeleteMany({"user_id": user_id, "group_id": {"$in": missing}}))
+                summary["removed"] = len(missing)
+
+            if ops:
+                self.db.target_groups.bulk_write(ops, ordered=False)
+            logger.info(f"Synced target groups for {user_id}: {summary}")
+        except BulkWriteError as e:
+            summary["errors"] = len(e.details.get("writeErrors", []))
+            logger.error(f"Target group sync for {user_id} had {summary['errors']} failed writes")
+        except Exception as e:
+            logger.error(f"Failed to sync target groups for {user_id}: {e}")
+            raise
+        return summary
+
     # ================= ANALYTICS & STATISTICS =================
 
     def get_user_analytics(self, user_id):
-        """Fetch analytics for a user."""
-        try:
-            stats = self.db.analytics.find_one({"user_id": user_id})
+        """Fetch pre-aggregated analytics totals for a user, plus last-24h sent/failed from the hourly buckets."""
+        try:
+            stats = self.db.analytics.find_one({"user_id": user_id}, {"groups": 0, "accounts": 0})
+            if stats:
+                stats["recent"] = self.get_recent_stats(user_id, hours=24)
+            pending = self.analytics_writer.pending({"user_id": user_id})
+            if stats and pending:
+                # Include counters that are still waiting for the next flush
+                for field, amount in pending.items():
+                    if field.startswith("total_"):
+                        stats[field] = stats.get(field, 0) + amount
             return stats if stats else {
                 "total_broadcasts": 0,
                 "total_sent": 0,
@@ -654,29 +940,69 @@ class EnhancedDatabaseManager:
             }
 
     def increment_broadcast_stats(self, user_id, success, group_id=None, account_id=None):
-        """Increment broadcast stats for a user, optionally tracking group and account stats."""
+        """Increment broadcast stats for a user, optionally tracking group and account stats.
+        Counters are buffered by analytics_writer and reach MongoDB on its next flush."""
         try:
-            update = {
-                "$inc": {
-                    "total_sent" if success else "total_failed": 1,
-                    "total_broadcasts": 1
-                },
-                "$set": {"updated_at": datetime.utcnow()}
+            inc = {
+                "total_sent" if success else "total_failed": 1,
+                "total_broadcasts": 1
             }
-            if group_id:
-                update["$inc"][f"groups.{group_id}.sent" if success else f"groups.{group_id}.failed"] = 1
-            if account_id:
-                update["$inc"][f"accounts.{account_id}.sent" if success else f"accounts.{account_id}.failed"] = 1
-            self.db.analytics.update_one(
-                {"user_id": user_id},
-                update,
-                upsert=True
+            self.analytics_writer.increment({"user_id": user_id}, inc)
+            # Per group/account counters go to hourly buckets so the analytics document stays small
+            self.analytics_writer.increment(
+                {
+                    "user_id": user_id,
+                    "account_id": account_id,
+                    "group_id": group_id,
+                    "bucket": hour_bucket(datetime.utcnow())
+                },
+                {"sent" if success else "failed": 1},
+                collection="analytics_buckets"
             )
-            logger.info(f"Updated broadcast stats for user {user_id}: {'success' if success else 'failure'}")
+            logger.debug(f"Queued broadcast stats for user {user_id}: {'success' if success else 'failure'}")
         except Exception as e:
             logger.error(f"Failed to update broadcast stats for {user_id}: {e}")
             raise
 
+    def _rollup_buckets(self, user_id, group_by, since=None):
+        """Sum sent/failed from analytics_buckets for a user, grouped by `group_by` (a field path or None)."""
+        match = {"user_id": user_id}
+        if since is not None:
+            match["bucket"] = {"$gte": since}
+        pipeline = [
+            {"$match": match},
+            {"$group": {"_id": group_by, "sent": {"$sum": "$sent"}, "failed": {"$sum": "$failed"}}}
+        ]
+        return list(self.db.analytics_buckets.aggregate(pipeline))
+
+    def get_recent_stats(self, user_id, hours=24):
+        """Total sent/failed for a user over the last `hours` hourly buckets."""
+        try:
+            rows = self._rollup_buckets(user_id, None, recent_buckets_since(hours))
+            row = rows[0] if rows else {}
+            return {"sent": row.get("sent", 0), "failed": row.get("failed", 0)}
+        except Exception as e:
+            logger.error(f"Failed to get recent stats for {user_id}: {e}")
+            return {"sent": 0, "failed": 0}
+
+    def get_group_stats(self, user_id, since=None):
+        """Sent/failed per group for a user, optionally only buckets at or after `since`."""
+        try:
+            rows = self._rollup_buckets(user_id, "$group_id", since)
+            return {row["_id"]: {"sent": row["sent"], "failed": row["failed"]} for row in rows if row["_id"] is not None}
+        except Exception as e:
+            logger.error(f"Failed to get group stats for {user_id}: {e}")
+            return {}
+
+    def get_account_stats(self, user_id, since=None):
+        """Sent/failed per account for a user, optionally only buckets at or after `since`."""
+        try:
+            rows = self._rollup_buckets(user_id, "$account_id", since)
+            return {row["_id"]: {"sent": row["sent"], "failed": row["failed"]} for row in rows if row["_id"] is not None}
+        except Exception as e:
+            logger.error(f"Failed to get account stats for {user_id}: {e}")
+            return {}
+
     def increment_vouch_success(self, channel_id):
         """Increment vouch success count."""
         try:
@@ -688,7 +1014,7 @@ class EnhancedDatabaseManager:
                 },
                 upsert=True
             )
-            logger.info(f"Incremented vouch success for channel {channel_id}")
+            logger.debug(f"Incremented vouch success for channel {channel_id}")
         except Exception as e:
             logger.error(f"Failed to increment vouch success for {channel_id}: {e}")
             raise
@@ -813,7 +1139,7 @@ class EnhancedDatabaseManager:
     def get_user_status(self, user_id):
         """Get user status information including user_type and accounts_limit"""
         try:
-            user = self.db.users.find_one({"user_id": user_id})
+            user = self.get_user(user_id, view_fields(UserStatusView))
             if user:
                 return {
                     "user_type": user.get("user_type", "free"),
@@ -851,10 +1177,7 @@ class EnhancedDatabaseManager:
     def is_user_premium(self, user_id):
         """Check if user has premium status"""
         try:
-            user = self.db.users.find_one({"user_id": user_id})
-            if user:
-                return user.get("user_type", "free") == "premium"
-            return False
+            return self.db.users.find_one({"user_id": user_id, "user_type": "premium"}, {"_id": 1}) is not None
         except Exception as e:
             logger.error(f"Failed to check premium status for {user_id}: {e}")
             return False
@@ -876,6 +1199,7 @@ class EnhancedDatabaseManager:
                 },
                 upsert=True  # Create user document if it doesn't exist
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"API credentials stored for user {user_id}: api_id={api_id}")
             return True
         except Exception as e:
@@ -895,6 +1219,7 @@ class EnhancedDatabaseManager:
                     }
                 }
             )
+            self.settings_cache.invalidate(user_id)
             logger.info(f"API credentials deleted for user {user_id}")
             return True
         except Exception as e:
@@ -903,26 +1228,17 @@ class EnhancedDatabaseManager:
 
     def get_user_api_credentials(self, user_id):
         """Get user's API credentials"""
-        try:
-            user = self.db.users.find_one({"user_id": user_id}, {"api_id": 1, "api_hash": 1})
-            if user and "api_id" in user and "api_hash" in user:
-                return {
-                    "api_id": user["api_id"],
-                    "api_hash": user["api_hash"]
-                }
-            return None
-        except Exception as e:
-            logger.error(f"Failed to get API credentials for {user_id}: {e}")
-            return None
+        settings = self.get_user_settings(user_id)
+        if settings.api_id is not None and settings.api_hash is not None:
+            return {
+                "api_id": settings.api_id,
+                "api_hash": settings.api_hash
+            }
+        return None
 
     def has_user_api_credentials(self, user_id):
         """Check if user has stored API credentials"""
-        try:
-            user = self.db.users.find_one({"user_id": user_id}, {"api_id": 1, "api_hash": 1})
-            return user and "api_id" in user and "api_hash" in user
-        except Exception as e:
-            logger.error(f"Failed to check API credentials for {user_id}: {e}")
-            return False
+        return self.get_user_api_credentials(user_id) is not None
 
     def clear_user_api_credentials(self, user_id):
         """Clear user's API credentials completely from MongoDB - SIMPLIFIED AND DIRECT"""
@@ -930,7 +1246,7 @@ class EnhancedDatabaseManager:
             logger.info(f"ðŸ”„ Starting API credentials clearing for user {user_id}")
             
             # First, check if user exists
-            user_before = self.db.users.find_one({"user_id": user_id})
+            user_before = self.get_user(user_id, view_fields(UserCredentialsView))
             if not user_before:
                 logger.warning(f"âŒ User {user_id} not found in database")
                 return False
@@ -959,8 +1275,10 @@ class EnhancedDatabaseManager:
             
             logger.info(f"ðŸ“ MongoDB update result: matched={result.matched_count}, modified={result.modified_count}")
             
+            self.settings_cache.invalidate(user_id)
+            
             # Immediate verification
-            user_after = self.db.users.find_one({"user_id": user_id})
+            user_after = self.get_user(user_id, view_fields(UserCredentialsView))
             has_api_id = "api_id" in user_after if user_after else False
             has_api_hash = "api_hash" in user_after if user_after else False
             
@@ -981,16 +1299,11 @@ class EnhancedDatabaseManager:
             return False
 
     def set_user_temp_data(self, user_id, key, value):
-        """Store temporary data for user (like temp API ID)"""
+        """Store temporary data for user (like temp API ID). Expires via the user_temp_data TTL index."""
         try:
-            result = self.db.users.update_one(
-                {"user_id": user_id},
-                {
-                    "$set": {
-                        f"temp_data.{key}": value,
-                        f"temp_data.{key}_timestamp": datetime.now()
-                    }
-                },
+            result = self.db.user_temp_data.update_one(
+                {"user_id": user_id, "key": key},
+                {"$set": {"value": value, "timestamp": datetime.utcnow()}},
                 upsert=True
             )
             return result.acknowledged
@@ -1001,23 +1314,13 @@ class EnhancedDatabaseManager:
     def get_user_temp_data(self, user_id, key):
         """Get temporary data for user"""
         try:
-            user = self.db.users.find_one({"user_id": user_id})
-            if not user or "temp_data" not in user:
-                return None
-            
-            temp_data = user["temp_data"]
-            if key not in temp_data:
-                return None
-                
-            # Check if data is not too old (30 minutes)
-            timestamp_key = f"{key}_timestamp"
-            if timestamp_key in temp_data:
-                timestamp = temp_data[timestamp_key]
-                if (datetime.now() - timestamp).total_seconds() > 1800:  # 30 minutes
-                    self.clear_user_temp_data(user_id, key)
-                    return None
-                    
-            return temp_data[key]
+            # The TTL monitor runs about once a minute, so also filter rows it has not reaped yet
+            cutoff = datetime.utcnow() - timedelta(seconds=config.USER_TEMP_DATA_TTL)
+            doc = self.db.user_temp_data.find_one(
+                {"user_id": user_id, "key": key, "timestamp": {"$gt": cutoff}},
+                {"value": 1}
+            )
+            return doc.get("value") if doc else None
         except Exception as e:
             logger.error(f"Failed to get temp data for {user_id}: {e}")
             return None
@@ -1025,15 +1328,7 @@ class EnhancedDatabaseManager:
     def clear_user_temp_data(self, user_id, key):
         """Clear specific temporary data for user"""
         try:
-            result = self.db.users.update_one(
-                {"user_id": user_id},
-                {
-                    "$unset": {
-                        f"temp_data.{key}": "",
-                        f"temp_data.{key}_timestamp": ""
-                    }
-                }
-            )
+            result = self.db.user_temp_data.delete_one({"user_id": user_id, "key": key})
             return result.acknowledged
         except Exception as e:
             logger.error(f"Failed to clear temp data for {user_id}: {e}")
@@ -1085,30 +1380,29 @@ class EnhancedDatabaseManager:
 
     def get_current_ad_cycle(self, user_id):
         """Get current ad cycle index for rotation"""
-        try:
-            user = self.db.users.find_one({"user_id": user_id}, {"ad_cycle_index": 1})
-            return user.get("ad_cycle_index", 0) if user else 0
-        except Exception as e:
-            logger.error(f"Failed to get ad cycle for {user_id}: {e}")
-            return 0
+        return self.get_user_settings(user_id).ad_cycle_index
 
     def update_ad_cycle(self, user_id):
-        """Update ad cycle index for next message rotation"""
+        """Atomically advance the ad cycle index on the server and return the new index."""
         try:
-            # Use the user's selected saved messages count instead of stored messages
-            user_msg_count = self.get_user_saved_messages_count(user_id)
-            if user_msg_count == 0:
-                return 0
-            
-            current_cycle = self.get_current_ad_cycle(user_id)
-            next_cycle = (current_cycle + 1) % user_msg_count
-            
-            self.db.users.update_one(
+            # Use the user's selected saved messages count instead of stored messages;
+            # a count of 0 leaves nothing to rotate, so the index stays at 0
+            msg_count = {"$ifNull": ["$saved_messages_count", 3]}
+            current_cycle = {"$ifNull": ["$ad_cycle_index", 0]}
+            doc = self.db.users.find_one_and_update(
                 {"user_id": user_id},
-                {"$set": {"ad_cycle_index": next_cycle}},
-                upsert=True
+                [{"$set": {"ad_cycle_index": {"$cond": [
+                    {"$gt": [msg_count, 0]},
+                    {"$mod": [{"$add": [current_cycle, 1]}, msg_count]},
+                    0
+                ]}}}],
+                projection={"_id": 0, "ad_cycle_index": 1, "saved_messages_count": 1},
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER
             )
-            logger.info(f"Updated ad cycle for user {user_id}: {current_cycle} -> {next_cycle} (out of {user_msg_count} messages)")
+            self.settings_cache.invalidate(user_id)
+            next_cycle = doc.get("ad_cycle_index", 0) if doc else 0
+            logger.debug(f"Updated ad cycle for user {user_id}: -> {next_cycle} (out of {doc.get('saved_messages_count', 3) if doc else 3} messages)")
             return next_cycle
         except Exception as e:
             logger.error(f"Failed to update ad cycle for {user_id}: {e}")
@@ -1124,7 +1418,7 @@ class EnhancedDatabaseManager:
                 {"$set": {"value": value, "updated_at": datetime.utcnow()}},
                 upsert=True
             )
-            logger.info(f"Set temp data for {user_id} [{key}] = {value}")
+            logger.debug(f"Set temp data for {user_id} [{key}]")
         except Exception as e:
             logger.error(f"Failed to set temp data for {user_id}: {e}")
 
@@ -1160,86 +1454,131 @@ class EnhancedDatabaseManager:
 
     # ================= ADMIN FUNCTIONS =================
 
-    def get_all_users(self, page=0, limit=0):
-        """Fetch all users with optional pagination (limit=0 for all users)."""
+    def get_all_users(self, page=0, limit=0, after_id=None):
+        """
+        Fetch all users with optional pagination (limit=0 for all users).
+        Pass the last _id of the previous page as after_id to page by key
+        instead of skip; prefer iter_users() for full scans.
+        """
         try:
             if limit == 0:
                 return list(self.db.users.find({}))
+            if after_id is not None or page == 0:
+                page_query, _ = keyset_page_args({}, None, after_id)
+                return list(self.db.users.find(page_query).sort("_id", 1).limit(limit))
             skip = page * limit
-            return list(self.db.users.find({}).skip(skip).limit(limit))
+            return list(self.db.users.find({}).sort("_id", 1).skip(skip).limit(limit))
         except Exception as e:
             logger.error(f"Failed to get all users: {e}")
             return []
 
-    def get_admin_stats(self):
-        """Fetch admin statistics with aggregated analytics across all users."""
+    def iter_users(self, query=None, projection=None, batch_size=config.SCAN_BATCH_SIZE):
+        """Stream users (optionally filtered/projected) in _id order with constant memory."""
+        return iter_keyset(self.db.users, query, projection, batch_size)
+
+    ADMIN_STATS_DEFAULTS = {
+        "total_users": 0,
+        "total_forwards": 0,
+        "total_accounts": 0,
+        "active_logger_users": 0,
+        "vouch_successes": 0,
+        "vouch_failures": 0,
+        "total_broadcasts": 0,
+        "total_failed": 0
+    }
+
+    def refresh_admin_stats(self):
+        """
+        Recompute admin statistics and store them in the admin_stats document.
+        Analytics sums and the active logger count come from a single aggregation;
+        user and account totals use collection metadata instead of full counts.
+        """
         try:
-            total_users = self.db.users.count_documents({})
-            logger.info(f"Total users fetched: {total_users}")
-            total_accounts = self.db.accounts.count_documents({})
-            logger.info(f"Total accounts fetched: {total_accounts}")
-            
-            # Aggregate user analytics
-            analytics_pipeline = [
+            pipeline = [
                 {
                     "$group": {
                         "_id": None,
                         "total_sent": {"$sum": "$total_sent"},
                         "total_failed": {"$sum": "$total_failed"},
-                        "total_broadcasts": {"$sum": "$total_broadcasts"}
+                        "total_broadcasts": {"$sum": "$total_broadcasts"},
+                        "vouch_successes": {"$sum": "$vouch_successes"},
+                        "vouch_failures": {"$sum": "$vouch_failures"}
                     }
-                }
-            ]
-            analytics_result = list(self.db.analytics.aggregate(analytics_pipeline))
-            analytics_stats = analytics_result[0] if analytics_result else {
-                "total_sent": 0,
-                "total_failed": 0,
-                "total_broadcasts": 0
-            }
-            logger.info(f"Analytics stats: {analytics_stats}")
-
-            # Aggregate vouch stats
-            vouch_pipeline = [
+                },
+                {
+                    "$unionWith": {
+                        "coll": "logger_status",
+                        "pipeline": [
+                            {"$match": {"is_active": True}},
+                            {"$count": "active_logger_users"}
+                        ]
+                    }
+                },
                 {
                     "$group": {
                         "_id": None,
+                        "total_sent": {"$sum": "$total_sent"},
+                        "total_failed": {"$sum": "$total_failed"},
+                        "total_broadcasts": {"$sum": "$total_broadcasts"},
                         "vouch_successes": {"$sum": "$vouch_successes"},
-                        "vouch_failures": {"$sum": "$vouch_failures"}
+                        "vouch_failures": {"$sum": "$vouch_failures"},
+                        "active_logger_users": {"$sum": "$active_logger_users"}
                     }
                 }
             ]
-            vouch_result = list(self.db.analytics.aggregate(vouch_pipeline))
-            vouch_stats = vouch_result[0] if vouch_result else {
-                "vouch_successes": 0,
-                "vouch_failures": 0
+            result = list(self.db.analytics.aggregate(pipeline))
+            totals = result[0] if result else {}
+
+            stats = {
+                "total_users": self.db.users.estimated_document_count(),
+                "total_forwards": totals.get("total_sent", 0),
+                "total_accounts": self.db.accounts.estimated_document_count(),
+                "active_logger_users": totals.get("active_logger_users", 0),
+                "vouch_successes": totals.get("vouch_successes", 0),
+                "vouch_failures": totals.get("vouch_failures", 0),
+                "total_broadcasts": totals.get("total_broadcasts", 0),
+                "total_failed": totals.get("total_failed", 0),
+                "refreshed_at": datetime.utcnow()
             }
-            logger.info(f"Vouch stats: {vouch_stats}")
+            self.db.admin_stats.update_one({"_id": "global"}, {"$set": stats}, upsert=True)
+            self._admin_stats = stats
+            logger.info(f"Admin stats refreshed: {stats}")
+            return stats
+        except Exception as e:
+            logger.error(f"Failed to refresh admin stats: {e}")
+            return None
+        finally:
+            self._admin_stats_refreshing.clear()
+
+    def get_admin_stats(self, max_age=None):
+        """
+        Fetch admin statistics from the materialized admin_stats document.
+
+        Stats older than max_age (ADMIN_STATS_MAX_AGE by default) are served as-is
+        while a background refresh runs; only the very first read waits for one.
+        The result carries refreshed_at and stale_seconds.
+        """
+        max_age = config.ADMIN_STATS_MAX_AGE if max_age is None else max_age
+        try:
+            stats = self._admin_stats
+            if stats is None:
+                stats = self.db.admin_stats.find_one({"_id": "global"}, {"_id": 0})
+                if stats is None:
+                    self._admin_stats_refreshing.set()
+                    stats = self.refresh_admin_stats()
+                    if stats is None:
+                        return dict(self.ADMIN_STATS_DEFAULTS, refreshed_at=None, stale_seconds=None)
+                self._admin_stats = stats
 
-            active_logger_users = self.db.logger_status.count_documents({"is_active": True})
-            logger.info(f"Active logger users: {active_logger_users}")
+            age = (datetime.utcnow() - stats["refreshed_at"]).total_seconds()
+            if age > max_age and not self._admin_stats_refreshing.is_set():
+                self._admin_stats_refreshing.set()
+                threading.Thread(target=self.refresh_admin_stats, name="admin-stats-refresh", daemon=True).start()
 
-            return {
-                "total_users": total_users,
-                "total_forwards": analytics_stats["total_sent"],
-                "total_accounts": total_accounts,
-                "active_logger_users": active_logger_users,
-                "vouch_successes": vouch_stats["vouch_successes"],
-                "vouch_failures": vouch_stats["vouch_failures"],
-                "total_broadcasts": analytics_stats["total_broadcasts"],
-                "total_failed": analytics_stats["total_failed"]
-            }
+            return dict(stats, stale_seconds=int(age))
         except Exception as e:
             logger.error(f"Failed to get admin stats: {e}")
-            return {
-                "total_users": 0,
-                "total_forwards": 0,
-                "total_accounts": 0,
-                "active_logger_users": 0,
-                "vouch_successes": 0,
-                "vouch_failures": 0,
-                "total_broadcasts": 0,
-                "total_failed": 0
-            }
+            return dict(self.ADMIN_STATS_DEFAULTS, refreshed_at=None, stale_seconds=None)
     # ================= AUTO REPLIES MANAGEMENT =================
     
     def reset_all_auto_replies(self):
@@ -1260,13 +1599,15 @@ class EnhancedDatabaseManager:
         Called when the user deletes their last account or manually requests deletion.
         """
         try:
+            for doc in self.db.accounts.find({"user_id": user_id}, {"_id": 1}):
+                session_cache.invalidate_account(doc["_id"])
             collections = [
                 "users", "accounts", "ad_messages", "ad_pointers",
                 "ad_delays", "group_msg_delays", "cycle_timeouts",
                 "broadcast_states", "broadcast_logs", "broadcast_activity",
-                "blacklisted_groups", "temp_blacklist", "analytics",
+                "blacklisted_groups", "temp_blacklist", "analytics", "analytics_buckets",
                 "auto_replies", "target_groups", "logger_status",
-                "logger_failures", "temp_data"
+                "logger_failures", "temp_data", "user_temp_data", "dialog_cache"
             ]
             deleted_total = 0
             for coll in collections:
@@ -1278,6 +1619,9 @@ class EnhancedDatabaseManager:
                         logger.info(f"ðŸ§¹ Deleted {result.deleted_count} from {coll} for user {user_id}")
                         deleted_total += result.deleted_count
 
+            self._blacklist_indexes.invalidate(user_id)
+            self.settings_cache.invalidate(user_id)
+
             if deleted_total == 0:
                 logger.info(f"â„¹ï¸ No user data found to delete for user {user_id}")
 
@@ -1288,19 +1632,10 @@ class EnhancedDatabaseManager:
             logger.error(f"âŒ Failed to fully delete user {user_id}: {e}")
             return False
 
-# Module-level function for backward compatibility
-def reset_all_auto_replies():
-    """Module-level function to reset all auto replies."""
-    try:
-        db_manager = EnhancedDatabaseManager()
-        return db_manager.reset_all_auto_replies()
-    except Exception as e:
-        logger.error(f"âŒ Failed to reset auto replies: {e}")
-        return 0
-
     def close(self):
-        """Close MongoDB connection."""
+        """Flush buffered analytics and close MongoDB connection."""
         try:
+            self.analytics_writer.close()
             if self.client is not None:
                 self.client.close()
                 logger.info("MongoDB connection closed")
@@ -1308,3 +1643,26 @@ def reset_all_auto_replies():
             logger.error(f"Failed to close MongoDB connection: {e}")
             raise
 
+# Time every public manager method (db_method_seconds{method=...})
+instrument_methods(EnhancedDatabaseManager)
+
+_shared_manager = None
+_shared_manager_lock = threading.Lock()
+
+def _get_shared_manager():
+    """One manager (and one set of background threads) reused by the module-level helpers."""
+    global _shared_manager
+    with _shared_manager_lock:
+        if _shared_manager is None:
+            _shared_manager = EnhancedDatabaseManager()
+        return _shared_manager
+
+# Module-level function for backward compatibility
+def reset_all_auto_replies():
+    """Module-level function to reset all auto replies."""
+    try:
+        return _get_shared_manager().reset_all_auto_replies()
+    except Exception as e:
+        logger.error(f"âŒ Failed to reset auto replies: {e}")
+        return 0
+
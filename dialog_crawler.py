@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _peer_key(peer):
+    """Hashable key for a raw Peer* object."""
+    if isinstance(peer, raw.types.PeerChannel):
+        return ("channel", peer.channel_id)
+    if isinstance(peer, raw.types.PeerChat):
+        return ("chat", peer.chat_id)
+    return ("user", getattr(peer, "user_id", None))
+
+
+def _group_id(chat):
+    """Bot API style id: -100<id> for channels/supergroups, -<id> for basic groups."""
+    if isinstance(chat, raw.types.Channel):
+        return -1000000000000 - chat.id
+    return -chat.id
+
+
+def _send_banned(rights):
+    return rights is not None and bool(getattr(rights, "send_messages", False))
+
+
+def can_post(chat):
+    """True for a group (basic or supergroup) this account can currently send messages to."""
+    if isinstance(chat, raw.types.Channel):
+        if chat.left or not chat.megagroup:
+            return False  # Broadcast channels and groups we left are not ad targets
+        if chat.creator or chat.admin_rights is not None:
+            return True
+        if chat.gigagroup:
+            return False  # Only admins may post in broadcast groups
+        return not _send_banned(chat.banned_rights) and not _send_banned(chat.default_banned_rights)
+    if isinstance(chat, raw.types.Chat):
+        if chat.left or chat.deactivated or chat.migrated_to is not None:
+            return False
+        if chat.creator or chat.admin_rights is not None:
+            return True
+        return not _send_banned(chat.default_banned_rights)
+    return False  # ChatForbidden / ChannelForbidden / anything else
+
+
+def _input_peer(peer, chats, users):
+    """Turn a dialog's Peer into the InputPeer GetDialogs expects as offset_peer."""
+    kind, peer_id = _peer_key(peer)
+    if kind == "channel":
+        chat = chats.get(("channel", peer_id))
+        return raw.types.InputPeerChannel(channel_id=peer_id, access_hash=getattr(chat, "access_hash", 0) or 0)
+    if kind == "chat":
+        return raw.types.InputPeerChat(chat_id=peer_id)
+    user = users.get(peer_id)
+    return raw.types.InputPeerUser(user_id=peer_id, access_hash=getattr(user, "access_hash", 0) or 0)
+
+
+def _cursor_to_peer(cursor):
+    kind = cursor["peer_type"]
+    if kind == "channel":
+        return raw.types.InputPeerChannel(channel_id=cursor["peer_id"], access_hash=cursor["access_hash"])
+    if kind == "chat":
+        return raw.types.InputPeerChat(chat_id=cursor["peer_id"])
+    if kind == "user":
+        return raw.types.InputPeerUser(user_id=cursor["peer_id"], access_hash=cursor["access_hash"])
+    return raw.types.InputPeerEmpty()
+
+
+class DialogCrawler:
+    """
+    Builds a user's target_groups from the groups their accounts have joined.
+
+    Each account's dialogs are paged with raw messages.GetDialogs through the
+    pooled clients (get_clients / release_clients, as in main.py), several
+    accounts at a time. After every page the offset and the groups found so
+    far are checkpointed on the account's dialog_cache document, so a crawl
+    cut short by a FloodWait or restart resumes from that page. A finished
+    crawl is cached there for refresh_interval seconds; refresh() then applies
+    the union of all accounts' groups with sync_target_groups, so broadcast
+    cycles only ever read target_groups. refresh_due() is driven by a
+    background loop, outside any cycle's timeout, so groups joined or left
+    later are picked up every refresh_interval.
+    """
+
+    def __init__(self, db, get_clients, release_clients, refresh_interval=config.DIALOG_REFRESH_INTERVAL,
+                 page_size=config.DIALOG_PAGE_SIZE, page_delay=config.DIALOG_PAGE_DELAY,
+                 concurrency=config.DIALOG_CRAWL_CONCURRENCY):
+        self.db = db
+        self.cache = db.db.dialog_cache
+        self.get_clients = get_clients
+        self.release_clients = release_clients
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.concurrency = concurrency
+        self._user_locks = {}
+        self._refreshed = {}  # user_id -> monotonic time of the last successful refresh
+
+    async def refresh(self, user_id, force=False):
+        """
+        Update target_groups from every account's (cached or freshly crawled)
+        groups. Returns the sync_target_groups summary, or None without accounts.
+        Groups are only removed when every account's list is complete.
+        """
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            clients = await self.get_clients(user_id)
+            if not clients:
+                logger.warning(f"No accounts available to crawl dialogs for user {user_id}")
+                return None
+            try:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                results = await asyncio.gather(*(
+                    self._account_groups(user_id, client_info, force, semaphore) for client_info in clients
+                ))
+            finally:
+                self.release_clients(clients)
+
+            groups = {}
+            complete = True
+            for account_groups, account_complete in results:
+                complete = complete and account_complete
+                for group in account_groups:
+                    groups[group["group_id"]] = group["group_name"]
+
+            summary = await self.db.sync_target_groups(user_id, list(groups.items()), remove_missing=complete)
+            logger.info(f"Dialog refresh for user {user_id}: {len(groups)} postable groups from {len(clients)} accounts, {summary}")
+            return summary
+
+    async def refresh_due(self, user_ids):
+        """Refresh each user in user_ids not refreshed for refresh_interval seconds. Returns how many were."""
+        user_ids = set(user_ids)
+        # Forget users whose broadcast stopped so the bookkeeping stays bounded
+        self._refreshed = {uid: at for uid, at in self._refreshed.items() if uid in user_ids}
+        self._user_locks = {uid: lock for uid, lock in self._user_locks.items() if uid in user_ids or lock.locked()}
+
+        refreshed = 0
+        for user_id in user_ids:
+            last = self._refreshed.get(user_id)
+            if last is not None and time.monotonic() - last < self.refresh_interval:
+                continue
+            try:
+                summary = await self.refresh(user_id)
+            except Exception as e:
+                logger.error(f"Dialog refresh for user {user_id} failed: {e}")
+                continue
+            if summary is not None:
+                self._refreshed[user_id] = time.monotonic()
+                refreshed += 1
+        return refreshed
+
+    async def _account_groups(self, user_id, client_info, force, semaphore):
+        """Return (groups, complete) for one account, crawling only if its cache is stale."""
+        account_id = client_info['db_id']
+        doc = await self.cache.find_one({"account_id": account_id}) or {}
+        fresh_after = datetime.utcnow() - timedelta(seconds=self.refresh_interval)
+        if not force and doc.get("cursor") is None and doc.get("refreshed_at") and doc["refreshed_at"] > fresh_after:
+            return doc.get("groups", []), True
+
+        async with semaphore:
+            return await self._crawl(user_id, client_info, doc.get("cursor"), doc.get("partial", []))
+
+    async def _crawl(self, user_id, client_info, cursor, partial):
+        client = client_info['client']
+        account_id = client_info['db_id']
+        found = {group["group_id"]: group for group in partial}
+        cursor = cursor or {"offset_date": 0, "offset_id": 0, "peer_type": "empty", "peer_id": 0, "access_hash": 0}
+        if partial:
+            logger.info(f"Resuming dialog crawl for account {account_id} with {len(found)} groups found")
+
+        while True:
+            try:
+                result = await client.invoke(raw.functions.messages.GetDialogs(
+                    offset_date=cursor["offset_date"],
+                    offset_id=cursor["offset_id"],
+                    offset_peer=_cursor_to_peer(cursor),
+                    limit=self.page_size,
+                    hash=0
+                ))
+            except FloodWait as e:
+                if e.value > config.MAX_FLOOD_WAIT:
+                    logger.warning(f"Dialog crawl for account {account_id} paused by a {e.value}s FloodWait, will resume later")
+                    return list(found.values()), False
+                await asyncio.sleep(e.value)
+                continue
+            except Exception as e:
+                logger.error(f"Dialog crawl for account {account_id} failed: {e}")
+                return list(found.values()), False
+
+            if isinstance(result, raw.types.messages.DialogsNotModified) or not result.dialogs:
+                break
+
+            chats = {}
+            for chat in result.chats:
+                kind = "channel" if isinstance(chat, (raw.types.Channel, raw.types.ChannelForbidden)) else "chat"
+                chats[(kind, chat.id)] = chat
+            users = {user.id: user for user in result.users}
+            messages = {(_peer_key(m.peer_id), m.id): m for m in result.messages if hasattr(m, "peer_id")}
+
+            page_groups = []
+            for dialog in result.dialogs:
+                chat = chats.get(_peer_key(dialog.peer))
+                if chat is not None and can_post(chat):
+                    group = {"group_id": _group_id(chat), "group_name": getattr(chat, "title", None)}
+                    if group["group_id"] not in found:
+                        found[group["group_id"]] = group
+                        page_groups.append(group)
+
+            last = result.dialogs[-1]
+            top = messages.get((_peer_key(last.peer), last.top_message))
+            offset_peer = _input_peer(last.peer, chats, users)
+            cursor = {
+                "offset_date": getattr(top, "date", 0) or 0,
+                "offset_id": last.top_message,
+                "peer_type": _peer_key(last.peer)[0],
+                "peer_id": _peer_key(last.peer)[1],
+                "access_hash": getattr(offset_peer, "access_hash", 0)
+            }
+            await self._checkpoint(user_id, account_id, cursor, page_groups)
+
+            # A full Dialogs (not a slice) or a short page is the last one
+            if not isinstance(result, raw.types.messages.DialogsSlice) or len(result.dialogs) < self.page_size:
+                break
+            await asyncio.sleep(self.page_delay)
+
+        groups = list(found.values())
+        await self.cache.update_one(
+            {"account_id": account_id},
+            {
+                "$set": {"user_id": user_id, "groups": groups, "refreshed_at": datetime.utcnow()},
+                "$unset": {"cursor": "", "partial": ""}
+            },
+            upsert=True
+        )
+        logger.info(f"Crawled dialogs for account {account_id}: {len(groups)} postable groups")
+        return groups, True
+
+    async def _checkpoint(self, user_id, account_id, cursor, page_groups):
+        """Persist the next page's offset and this page's groups in one write."""
+        update = {"$set": {"user_id": user_id, "cursor": cursor}}
+        if page_groups:
+            update["$push"] = {"partial": {"$each": page_groups}}
+        try:
+            await self.cache.update_one({"account_id": account_id}, update, upsert=True)
+        except Exception as e:
+            logger.error(f"Failed to checkpoint dialog crawl for account {account_id}: {e}")
@@ -0,0 +1,90 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bson
+
+import config
+from metrics import CPU_OFFLOAD
+
+logger = logging.getLogger(__name__)
+
+
+# Module-level so they can be pickled into a process pool
+
+def encrypt_text(cipher, plaintext):
+    """Fernet-encrypt a str and return the token as str."""
+    return cipher.encrypt(plaintext.encode()).decode()
+
+
+def decrypt_text(cipher, token):
+    """Fernet-decrypt a str token and return the plaintext str."""
+    return cipher.decrypt(token.encode()).decode()
+
+
+def decode_bson_field(raw, field, default=None):
+    """Decode raw BSON bytes and return one top-level field."""
+    return bson.decode(raw).get(field, default)
+
+
+class CPUExecutor:
+    """
+    Runs CPU-bound work (crypto, BSON decoding) off the event loop.
+
+    kind is "process" (sidesteps the GIL, arguments must be picklable),
+    "thread" (cheap hand-off, still releases the loop while C code runs) or
+    "inline" (no offload, for debugging). Time spent per label is recorded
+    so stats() shows how much work was moved off the loop.
+    """
+
+    def __init__(self, kind=config.CPU_EXECUTOR, workers=config.CPU_EXECUTOR_WORKERS):
+        self.kind = kind
+        self.workers = workers
+        self._pool = None
+        self._stats = {}  # label -> {'calls', 'seconds', 'max_seconds'}
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cpu")
+            logger.info(f"Started {self.kind} CPU executor with {self.workers} workers")
+        return self._pool
+
+    async def run(self, label, func, *args):
+        """Await func(*args) on the pool, recording its wall time under `label`."""
+        started_at = time.perf_counter()
+        try:
+            if self.kind == "inline":
+                return func(*args)
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), func, *args)
+        finally:
+            self._record(label, time.perf_counter() - started_at)
+
+    def _record(self, label, seconds):
+        CPU_OFFLOAD.observe(seconds, label=label)
+        with self._lock:
+            entry = self._stats.setdefault(label, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    def stats(self):
+        """Offloaded calls and time per label."""
+        with self._lock:
+            return {label: dict(entry) for label, entry in self._stats.items()}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Process-wide executor shared by the login, loader and database paths
+cpu_executor = CPUExecutor()
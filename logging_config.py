@@ -0,0 +1,116 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+import config
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg (+ suppressed when present)."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `limit` records per call site (logger + line) through every
+    `window` seconds; records at max_level and above always pass. The first
+    record after a window with drops carries the number dropped in
+    `suppressed`, so bursts stay visible without flooding the log.
+    """
+
+    def __init__(self, limit=config.LOG_RATE_LIMIT, window=config.LOG_RATE_WINDOW, max_level=logging.ERROR):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_level = max_level
+        self._sites = {}  # (logger, lineno) -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.max_level:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.setdefault((record.name, record.lineno), [now, 0, 0])
+            if now - site[0] >= self.window:
+                record.suppressed = site[2]
+                site[:] = [now, 0, 0]
+            if site[1] >= self.limit:
+                site[2] += 1
+                return False
+            site[1] += 1
+            return True
+
+
+def worker_log_file(log_file=config.LOG_FILE, index=config.WORKER_INDEX, total=config.WORKER_TOTAL):
+    """
+    Per-process log file name: with several sharded workers each gets its own
+    file (logs/Brutod_bot.worker1.log), since processes sharing one
+    RotatingFileHandler file lose or interleave records at rollover.
+    """
+    if total <= 1:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return f"{root}.worker{index}{ext}"
+
+
+def setup_logging(level=config.LOG_LEVEL, log_file=None):
+    """
+    Route every log record through a QueueHandler so callers (including the
+    event loop) never block on I/O. A QueueListener thread writes JSON lines
+    to a size-rotated file (worker_log_file() by default) and plain text to
+    stderr. Safe to call twice.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_file = log_file or worker_log_file()
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter() if config.LOG_JSON else logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    ))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filtering on the producer side keeps dropped records off the queue entirely
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,3 +1,18 @@
+import time
+
+import broadcast_engine
+import config
+import metrics
+from async_database import AsyncEnhancedDatabaseManager
+from cache import session_cache
+from checkpoint import BroadcastCheckpoint
+from dialog_crawler import DialogCrawler
+from executor import cpu_executor, encrypt_text
+from client_pool import ClientPool
+from rate_limiter import AdaptiveRateLimiter
+from scheduler import BroadcastScheduler
+from sharding import LeaseManager, local_shard_filter
+
 # =======================================================
 # 👤 ACCOUNT LOGIN & MANAGEMENT UTILITY
 # =======================================================
@@ -65,15 +80,15 @@ class AccountLoginUtility:
         """Saves the encrypted session string to the database."""
         try:
             session_string = client.session.save()
-            encrypted_session = self.cipher.encrypt(session_string.encode()).decode()
+            encrypted_session = await cpu_executor.run("session_encrypt", encrypt_text, self.cipher, session_string)
             
             me = await client.get_me()
             
             # Fetch current account count to assign the index (1), (2), etc.
-            current_count = self.db.db.accounts.count_documents({'user_id': user_id})
+            current_count = await self.db.get_user_accounts_count(user_id)
             account_index = current_count + 1 
             
-            self.db.db.accounts.insert_one({
+            result = await self.db.accounts.insert_one({
                 'user_id': user_id,
                 'session_string': encrypted_session,
                 'phone_number': phone_number,
@@ -82,6 +97,8 @@ class AccountLoginUtility:
                 'telegram_id': me.id,
                 'account_index': account_index # New field to track (1), (2)
             })
+            # The first broadcast with this account can skip decryption
+            session_cache.put(result.inserted_id, encrypted_session, session_string)
             
             return f"✅ Account added successfully! Your account index is ({account_index})"
         
@@ -98,82 +115,116 @@ class AccountLoginUtility:
             except Exception:
                 pass
 
+# Async view of the database so coroutines never block on pymongo calls
+async_db = AsyncEnhancedDatabaseManager(db)
+
 # Initialize the new utility class
-account_login_utility = AccountLoginUtility(db, cipher_suite)
+account_login_utility = AccountLoginUtility(async_db, cipher_suite)
 # =======================================================
 # 🔄 MULTI-ACCOUNT BOT HANDLER & LOADER
 # =======================================================
 
+# Warm Pyrogram clients shared across broadcast cycles, keyed by account _id
+client_pool = ClientPool()
+
 async def get_account_clients(user_id):
     """
     Load all active accounts for a user and return a list of (client, index) tuples.
     We use telethon for session handling and pyrogram for broadcasting.
+    Clients come from client_pool; pass the result to release_account_clients() when done.
+    Accounts start concurrently (bounded by CLIENT_START_CONCURRENCY); an account that
+    fails or exceeds CLIENT_START_TIMEOUT is skipped without delaying the others.
     """
-    accounts = db.get_user_accounts(user_id) # Assumes db.get_user_accounts() exists and is functional
+    accounts = await async_db.get_user_accounts(user_id)
     if not accounts:
         return []
     
     # Sort by account_index for consistent (1), (2) display
     sorted_accounts = sorted(accounts, key=lambda x: x.get('account_index', 999))
     
-    client_list = []
-    credentials = db.get_user_api_credentials(user_id)
+    credentials = await async_db.get_user_api_credentials(user_id)
     if not credentials:
         logger.error(f"No API credentials found for user {user_id}")
         return []
 
     api_id = credentials['api_id']
     api_hash = credentials['api_hash']
+    semaphore = asyncio.Semaphore(config.CLIENT_START_CONCURRENCY)
+    
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(
+        _load_account_client(user_id, account, api_id, api_hash, semaphore)
+        for account in sorted_accounts
+    ))
+    # gather preserves input order, so the (1), (2) ordering is kept
+    client_list = [info for info in results if info is not None]
+
+    logger.info(
+        f"Loaded {len(client_list)}/{len(sorted_accounts)} accounts for user {user_id} "
+        f"in {time.perf_counter() - started_at:.2f}s"
+    )
+    return client_list
+
+async def _load_account_client(user_id, account, api_id, api_hash, semaphore):
+    """Start (or reuse) the pooled client for one account. Returns its client info or None."""
+    acc_id = account['_id']
+    acc_index = account.get('account_index', 0)
     
-    for account in sorted_accounts:
-        acc_id = account['_id']
-        acc_index = account.get('account_index', 0)
+    if account_monitor.is_account_banned(acc_id):
+        logger.warning(f"Skipping banned account {acc_id} for user {user_id}")
+        return None
+
+    async def build_client():
+        # Decrypt the session string off the loop (only on a cold start, warm clients are reused)
+        session_str = await session_cache.decrypt_async(acc_id, account['session_string'], cipher_suite)
         
-        if account_monitor.is_account_banned(acc_id):
-            logger.warning(f"Skipping banned account {acc_id} for user {user_id}")
-            continue
+        # Use Pyrogram Client for broadcasting (more robust)
+        return PyroClient(
+            name=str(acc_id), # Unique ID for Pyrogram's session file
+            session_string=session_str,
+            api_id=api_id,
+            api_hash=api_hash
+        )
 
+    async with semaphore:
+        started_at = time.perf_counter()
         try:
-            # Decrypt the session string
-            session_str = cipher_suite.decrypt(account['session_string'].encode()).decode()
-            
-            # Use Pyrogram Client for broadcasting (more robust)
-            client = PyroClient(
-                name=str(acc_id), # Unique ID for Pyrogram's session file
-                session_string=session_str,
-                api_id=api_id,
-                api_hash=api_hash
+            # Reuse the warm client or start a new one (needs to be awaited)
+            client = await asyncio.wait_for(
+                client_pool.acquire(acc_id, build_client),
+                timeout=config.CLIENT_START_TIMEOUT
             )
-            
-            # Start the client (needs to be awaited)
-            await client.start()
+            logger.info(f"Account ({acc_index}) {acc_id} ready in {time.perf_counter() - started_at:.2f}s")
             
             # Store the Pyrogram client, its DB ID, and its assigned index
-            client_list.append({
+            return {
                 'client': client,
                 'db_id': acc_id,
                 'index': acc_index,
                 'phone': account.get('phone_number', 'N/A')
-            })
-            
-            # Start health monitoring for this account (using Telethon for monitoring)
-            # This part needs Telethon Client, so let's adjust or assume health check is done externally/periodically.
-            # For simplicity, we stick to Pyrogram for broadcasting.
+            }
             
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out starting client {acc_id} after {config.CLIENT_START_TIMEOUT}s")
         except InvalidToken:
             logger.error(f"Decryption failed for account {acc_id}. Key mismatch or corrupted data.")
             await account_monitor.remove_banned_account(user_id, acc_id, "Session String Corrupted/Invalid Token")
         except RPCError as e:
             logger.error(f"RPC Error starting client {acc_id}: {e}")
+            await client_pool.discard(acc_id)
             await account_monitor.remove_banned_account(user_id, acc_id, f"RPC Error: {e}")
         except Exception as e:
             logger.error(f"Unknown error starting client {acc_id}: {e}")
+        return None
 
-    return client_list
+def release_account_clients(client_list):
+    """Hand clients from get_account_clients() back to the pool without stopping them."""
+    for client_info in client_list:
+        client_pool.release(client_info['db_id'])
 
 async def format_account_status(user_id):
     """Formats the status list for the user, showing (1), (2), etc."""
-    accounts = db.get_user_accounts(user_id)
+    accounts = await async_db.get_user_accounts(user_id)
     if not accounts:
         return "<i>No accounts added yet.</i>"
     
@@ -199,16 +250,16 @@ setattr(db.__class__, 'get_user_accounts', get_user_accounts_enhanced)
 # ⚙️ ADVANCED BROADCAST CYCLING LOGIC
 # =======================================================
 
-# Configuration
-MESSAGES_PER_ACCOUNT = 3 
-
-# Global or User-Specific State Tracking (Isse Database ya Redis mein store karna best hai, 
-# lekin abhi hum memory mein simple rakhte hain, agar bot restart na ho to.)
-BROADCAST_STATE = {} # Key: user_id, Value: {'current_account_index': 0, 'current_msg_count': 0}
+# Send pacing shared by all cycles so each account keeps its learned rate
+rate_limiter = AdaptiveRateLimiter()
 
-async def start_broadcast_cycle(user_id, saved_messages, target_groups):
+async def start_broadcast_cycle(user_id, saved_messages, target_groups, cycle_id=None):
     """
-    Handles the broadcast using multiple accounts in a round-robin cycle (3 messages per account).
+    Handles the broadcast by fanning target_groups out across all live accounts.
+    Each account sends to its own share of groups concurrently with its own pacing.
+    Progress is checkpointed to broadcast_states, so a cycle interrupted by a
+    crash or deploy resumes without re-sending to groups it already reached;
+    cycle_id ties that progress to one rotation step so it is never reused by another.
     """
     
     # 1. Load Accounts
@@ -216,67 +267,101 @@ async def start_broadcast_cycle(user_id, saved_messages, target_groups):
     if len(all_clients) < 1:
         logger.error(f"No active accounts found for user {user_id}. Stopping broadcast.")
         return
-        
-    num_accounts = len(all_clients)
-    
-    # 2. Initialize State
-    if user_id not in BROADCAST_STATE:
-        BROADCAST_STATE[user_id] = {'current_account_index': 0, 'current_msg_count': 0}
 
-    state = BROADCAST_STATE[user_id]
-    
-    # 3. Main Broadcast Loop
-    total_messages_sent = 0
-    
-    for message in saved_messages: # saved_messages is a list of pyrogram Message objects or similar
-        
-        # Determine the current account to use
-        current_client_info = all_clients[state['current_account_index']]
-        client = current_client_info['client']
-        acc_index = current_client_info['index']
-        
-        # 4. SEND MESSAGE (This is where your existing send logic goes)
+    # 2. Fan out across accounts. run_cycle releases the clients in its own finally;
+    # nothing here awaits before it starts, so a cancellation cannot leak them
+    checkpoint = BroadcastCheckpoint(async_db.db.broadcast_states, user_id, cycle_id=cycle_id)
+    summary = await broadcast_engine.run_cycle(
+        user_id, all_clients, saved_messages, target_groups, async_db,
+        rate_limiter, checkpoint, release_account_clients
+    )
+    logger.info(f"Broadcast cycle finished for user {user_id}. Sent: {summary['sent']}, failed: {summary['failed']}, skipped: {summary['skipped']}.")
+    return summary
+
+async def run_scheduled_cycle(user_id):
+    """
+    One scheduled broadcast cycle for user_id. Returns False when the user's
+    broadcast has been stopped or paused so the scheduler drops them.
+    """
+    state = await async_db.get_broadcast_state(user_id)
+    if not state['running'] or state['paused']:
+        return False
+
+    saved_messages = await async_db.get_saved_messages(user_id)
+    # target_groups is kept in step with the accounts' joined groups by refresh_dialogs_forever()
+    target_groups = await async_db.get_target_groups(user_id)
+    # Rotate through the first saved_messages_count messages, one ad per cycle
+    saved_messages = saved_messages[:await async_db.get_user_saved_messages_count(user_id)]
+    if not saved_messages or not target_groups:
+        logger.warning(f"User {user_id} has no saved messages or target groups. Skipping cycle.")
+        return True
+
+    cycle_index = await async_db.get_current_ad_cycle(user_id) % len(saved_messages)
+    await start_broadcast_cycle(user_id, [saved_messages[cycle_index]], target_groups, cycle_id=cycle_index)
+    await async_db.increment_broadcast_cycle(user_id)
+    return True
+
+# Discovers postable groups from the accounts' dialogs and caches them per account
+dialog_crawler = DialogCrawler(async_db, get_account_clients, release_account_clients)
+
+# One scheduler drives every user's cycles through a fixed worker pool.
+# With WORKER_TOTAL > 1 each process only runs the users hashed to its shard,
+# guarded by per-user leases in broadcast_states.
+if config.WORKER_TOTAL > 1:
+    broadcast_scheduler = BroadcastScheduler(
+        run_scheduled_cycle, async_db,
+        owns=local_shard_filter(),
+        leases=LeaseManager(async_db.db.broadcast_states)
+    )
+else:
+    broadcast_scheduler = BroadcastScheduler(run_scheduled_cycle, async_db)
+
+for _field in ("scheduled", "overdue", "queued", "ready", "running"):
+    metrics.Gauge(
+        f"scheduler_{_field}", f"Broadcast scheduler: users {_field}",
+        callback=lambda field=_field: broadcast_scheduler.stats()[field]
+    )
+metrics.Gauge("client_pool_size", "Started Pyrogram clients held by the pool", callback=lambda: len(client_pool))
+
+async def refresh_dialogs_forever():
+    """
+    Re-crawl the joined groups of every running broadcast on this shard once
+    per DIALOG_REFRESH_INTERVAL, so target_groups follows groups the accounts
+    join or leave. Runs beside the scheduler, never inside a cycle's timeout.
+    """
+    while True:
         try:
-            # --- REPLACE THIS SECTION WITH YOUR ACTUAL MESSAGE SENDING LOGIC ---
-            # Example: Send the message to all target groups using the current 'client'
-            
-            logger.info(f"User {user_id} - Sending Message to {len(target_groups)} groups with Account ({acc_index})...")
-            
-            # A stub for sending: (assuming 'message' has a send_copy method or similar)
-            # await client.send_copy(chat_id=target_groups[0], from_chat_id=config.SAVED_MESSAGES_CHAT_ID, message_id=message.id)
-            # time.sleep(random.uniform(1, 3)) # Add delay to prevent flood
-            # -------------------------------------------------------------------
-            
-            total_messages_sent += 1
-            state['current_msg_count'] += 1
-            
-            logger.info(f"Sent message {total_messages_sent} with Account ({acc_index}). Account count: {state['current_msg_count']}/{MESSAGES_PER_ACCOUNT}")
-            
+            user_ids = [
+                user_id for user_id in await async_db.get_running_broadcast_users()
+                if broadcast_scheduler.owns is None or broadcast_scheduler.owns(user_id)
+            ]
+            refreshed = await dialog_crawler.refresh_due(user_ids)
+            if refreshed:
+                logger.info(f"Refreshed target groups from dialogs for {refreshed} users")
         except Exception as e:
-            logger.error(f"Broadcast failed for message by Account ({acc_index}): {e}")
-            # Consider removing account if it's a ban/flood error
-            pass
-            
-        # 5. Cycle Logic (Switch account after MESSAGES_PER_ACCOUNT messages)
-        if state['current_msg_count'] >= MESSAGES_PER_ACCOUNT:
-            # Reset message count
-            state['current_msg_count'] = 0
-            
-            # Move to the next account (Round-Robin)
-            state['current_account_index'] = (state['current_account_index'] + 1) % num_accounts
-            
-            logger.info(f"--- Switching to Account ({all_clients[state['current_account_index']]['index']}) ---")
-            
-            # Add a small delay after switching accounts
-            await asyncio.sleep(2) 
+            logger.error(f"Dialog refresh sweep failed: {e}")
+        await asyncio.sleep(config.DIALOG_REFRESH_CHECK_INTERVAL)
 
-    # Update Global State
-    BROADCAST_STATE[user_id] = state
-    logger.info(f"Broadcast cycle finished for user {user_id}. Total messages sent: {total_messages_sent}.")
-    
-    # Don't forget to stop all Pyrogram clients after the broadcast is truly over to release resources
-    for client_info in all_clients:
+async def start_broadcast_scheduler():
+    """
+    Start the scheduler, enqueue every broadcast that was running before a
+    restart, then keep picking up broadcasts started elsewhere (e.g. by the
+    bot process) that hash to this worker.
+    """
+    if config.METRICS_ENABLED:
+        # One port per shard so several workers can share a host
         try:
-            await client_info['client'].stop()
-        except Exception:
-            pass
\ No newline at end of file
+            await metrics.start_server(port=config.METRICS_PORT + config.WORKER_INDEX)
+        except OSError as e:
+            logger.error(f"Metrics endpoint disabled, could not bind port {config.METRICS_PORT + config.WORKER_INDEX}: {e}")
+    broadcast_scheduler.start()
+    # Held in a local so the task stays referenced while the rescan loop below runs
+    dialog_refresh_task = asyncio.create_task(refresh_dialogs_forever())
+    await broadcast_scheduler.sync_users(await async_db.get_running_broadcast_users())
+    logger.info(f"Broadcast scheduler resumed on shard {config.WORKER_INDEX}/{config.WORKER_TOTAL}: {broadcast_scheduler.stats()}")
+
+    while True:
+        await asyncio.sleep(config.SHARD_RESCAN_INTERVAL)
+        added = await broadcast_scheduler.sync_users(await async_db.get_running_broadcast_users())
+        if added:
+            logger.info(f"Scheduled {added} newly started broadcasts: {broadcast_scheduler.stats()}")
@@ -0,0 +1,237 @@
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic counter, optionally labelled."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self._values = {}
+        super().__init__(name, help_text, labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Point-in-time value: either set() explicitly or read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback=None):
+        self.callback = callback
+        self._value = 0
+        super().__init__(name, help_text)
+
+    def set(self, value):
+        self._value = value
+
+    def _samples(self):
+        value = self._value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback failed: {e}")
+                return []
+        return [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values (seconds, by convention)."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        super().__init__(name, help_text, labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with-block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ================= HOT-PATH METRICS =================
+
+DB_LATENCY = Histogram("db_method_seconds", "EnhancedDatabaseManager method latency", ["method"])
+DB_ERRORS = Counter("db_method_errors_total", "EnhancedDatabaseManager methods that raised", ["method"])
+SEND_LATENCY = Histogram("broadcast_send_seconds", "Latency of one copy_message send", ["account"])
+SENDS = Counter("broadcast_sends_total", "Broadcast send attempts by outcome", ["result"])
+FLOOD_WAITS = Counter("broadcast_flood_waits_total", "FloodWait errors received while broadcasting")
+FLOOD_WAIT_SECONDS = Counter("broadcast_flood_wait_seconds_total", "Seconds of FloodWait requested by Telegram")
+CPU_OFFLOAD = Histogram("cpu_offload_seconds", "Time spent in work offloaded to the CPU executor", ["label"])
+
+
+def timed(histogram, errors=None, **labels):
+    """
+    Decorator recording a function's latency in `histogram` (and exceptions in
+    `errors`). Works on plain and coroutine functions.
+    """
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**labels)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+    return decorate
+
+
+def instrument_methods(cls, histogram=DB_LATENCY, errors=DB_ERRORS, prefix="", exclude=()):
+    """
+    Wrap every public method of cls with timed(method=<prefix><name>).
+    Generators are left alone since their work happens after the call returns.
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or name in exclude or not inspect.isfunction(func):
+            continue
+        if inspect.isgeneratorfunction(func) or inspect.isasyncgenfunction(func):
+            continue
+        setattr(cls, name, timed(histogram, errors, method=prefix + name)(func))
+    return cls
+
+
+# ================= HTTP ENDPOINT =================
+
+async def start_server(host=config.METRICS_HOST, port=config.METRICS_PORT):
+    """Serve REGISTRY on http://host:port/metrics. Returns the aiohttp runner (call .cleanup() to stop)."""
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,113 @@
+"""
+One-off database migrations.
+
+Usage:
+    python migrations.py ensure-indexes
+    python migrations.py backfill-expiry
+    python migrations.py fold-nested-analytics
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import config
+from analytics import hour_bucket
+from database import EnhancedDatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_expiry_fields(db):
+    """
+    Give existing temp documents the fields their TTL indexes expire on.
+
+    - temp_blacklist rows without expires_at get created_at + TEMP_BLACKLIST_DEFAULT_DURATION
+    - temp_data rows without updated_at get the current time
+    - users.temp_data entries move to user_temp_data, keeping their timestamps
+    """
+    now = datetime.utcnow()
+
+    result = db.temp_blacklist.update_many(
+        {"expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$add": [
+            {"$ifNull": ["$created_at", now]},
+            config.TEMP_BLACKLIST_DEFAULT_DURATION * 1000
+        ]}}}]
+    )
+    logger.info(f"temp_blacklist: backfilled expires_at on {result.modified_count} documents")
+
+    result = db.temp_data.update_many(
+        {"updated_at": {"$exists": False}},
+        {"$set": {"updated_at": now}}
+    )
+    logger.info(f"temp_data: backfilled updated_at on {result.modified_count} documents")
+
+    # Legacy timestamps were written with datetime.now(); shift them to UTC like TTL expects
+    utc_offset = datetime.utcnow() - datetime.now()
+    moved = 0
+    for user in db.users.find({"temp_data": {"$exists": True}}, {"user_id": 1, "temp_data": 1}):
+        temp_data = user.get("temp_data") or {}
+        ops = []
+        for key, value in temp_data.items():
+            if key.endswith("_timestamp"):
+                continue
+            timestamp = temp_data.get(f"{key}_timestamp")
+            timestamp = timestamp + utc_offset if isinstance(timestamp, datetime) else now
+            ops.append(UpdateOne(
+                {"user_id": user["user_id"], "key": key},
+                {"$setOnInsert": {"value": value, "timestamp": timestamp}},
+                upsert=True
+            ))
+        if ops:
+            db.user_temp_data.bulk_write(ops, ordered=False)
+            moved += len(ops)
+        db.users.update_one({"_id": user["_id"]}, {"$unset": {"temp_data": ""}})
+    logger.info(f"users.temp_data: moved {moved} entries to user_temp_data")
+
+
+def fold_nested_analytics(db):
+    """
+    Move legacy groups.<id> / accounts.<id> counters off analytics documents
+    into analytics_buckets, using the hour of the document's updated_at.
+    Group and account counters were tracked independently, so each becomes
+    its own bucket row with the other dimension left as None.
+    """
+    folded = 0
+    query = {"$or": [{"groups": {"$exists": True}}, {"accounts": {"$exists": True}}]}
+    for doc in db.analytics.find(query, {"user_id": 1, "groups": 1, "accounts": 1, "updated_at": 1}):
+        bucket = hour_bucket(doc.get("updated_at") or datetime.utcnow())
+        ops = []
+        for field, dimension in (("groups", "group_id"), ("accounts", "account_id")):
+            for entity_id, counters in (doc.get(field) or {}).items():
+                match = {"user_id": doc["user_id"], "account_id": None, "group_id": None, "bucket": bucket}
+                match[dimension] = int(entity_id) if dimension == "group_id" and entity_id.lstrip("-").isdigit() else entity_id
+                inc = {k: v for k, v in counters.items() if k in ("sent", "failed")}
+                if inc:
+                    ops.append(UpdateOne(match, {"$inc": inc}, upsert=True))
+        if ops:
+            db.analytics_buckets.bulk_write(ops, ordered=False)
+            folded += len(ops)
+        db.analytics.update_one({"_id": doc["_id"]}, {"$unset": {"groups": "", "accounts": ""}})
+    logger.info(f"analytics: folded {folded} nested counters into analytics_buckets")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["ensure-indexes", "backfill-expiry", "fold-nested-analytics"])
+    args = parser.parse_args()
+
+    # Run the migration in the foreground, not the manager's background index check
+    config.DB_ENSURE_INDEXES_ON_START = False
+    manager = EnhancedDatabaseManager()
+    if args.command == "ensure-indexes":
+        manager.ensure_indexes()
+    elif args.command == "backfill-expiry":
+        backfill_expiry_fields(manager.db)
+    elif args.command == "fold-nested-analytics":
+        fold_nested_analytics(manager.db)
+
+
+if __name__ == "__main__":
+    main()
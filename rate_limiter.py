@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import random
+import time
+
+import config
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of polling.
+
+    reserve() always takes a token and returns how long the caller must wait
+    for it, letting the balance go negative; concurrent callers therefore
+    queue up in order without a lock.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now=None):
+        """Take one token and return the seconds to wait before using it."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        blocked = self.blocked_until - now
+        if blocked > wait:
+            self.defer(blocked - wait)
+            wait = blocked
+        return wait
+
+    def defer(self, seconds):
+        """Push the reservation just taken (and every later one) back by `seconds`."""
+        self.tokens -= seconds * self.rate
+
+    def block_for(self, seconds, now=None):
+        """Hold every reservation back for at least `seconds` from now."""
+        now = time.monotonic() if now is None else now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class AdaptiveRateLimiter:
+    """
+    Per-account and per-chat send pacing with AIMD rate adaptation.
+
+    Each account starts at, and never sends faster than, the user's group
+    message delay (nor faster than one send per min_interval). Every
+    successful send raises its rate additively back towards that ceiling and
+    every FloodWait halves it (down to one send per max_interval) and
+    blocks the account for the seconds Telegram asked for. A separate
+    bucket per target chat keeps any one chat from being hit faster than
+    chat_interval, whichever account sends (chat_interval <= 0 disables it).
+
+    Buckets idle for idle_ttl seconds are dropped, so accounts and chats that
+    stop sending do not stay in memory for the life of the process.
+    """
+
+    def __init__(self, min_interval=config.RATE_LIMIT_MIN_INTERVAL,
+                 max_interval=config.RATE_LIMIT_MAX_INTERVAL,
+                 chat_interval=config.RATE_LIMIT_CHAT_INTERVAL,
+                 increase_step=config.RATE_LIMIT_INCREASE_STEP,
+                 decrease_factor=config.RATE_LIMIT_DECREASE_FACTOR,
+                 jitter=config.RATE_LIMIT_JITTER,
+                 idle_ttl=config.RATE_LIMIT_IDLE_TTL,
+                 max_entries=config.RATE_LIMIT_MAX_ENTRIES):
+        self.min_interval = min_interval
+        self.max_rate = 1 / min_interval
+        self.min_rate = 1 / max_interval
+        self.chat_interval = chat_interval
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.jitter = jitter
+        # account_id -> {'interval', 'ceiling' (max rate allowed by the user's delay), 'bucket'}
+        self._accounts = TTLCache(maxsize=max_entries, ttl=idle_ttl)
+        self._chats = TTLCache(maxsize=max_entries, ttl=idle_ttl)  # chat_id -> TokenBucket
+
+    def register_account(self, account_id, interval):
+        """
+        Start pacing account_id at one send per `interval` seconds.
+        A learned rate is kept across cycles unless the user's delay changed.
+        """
+        entry = self._accounts.get(account_id)
+        if entry is not None and entry['interval'] == interval:
+            self._accounts.set(account_id, entry)  # Still in use: restart its idle timer
+            return
+        # A missing or zero delay falls back to the fastest allowed pace instead of dividing by zero
+        rate = min(self.max_rate, max(self.min_rate, 1 / max(interval or 0, self.min_interval)))
+        self._accounts.set(account_id, {'interval': interval, 'ceiling': rate, 'bucket': TokenBucket(rate)})
+
+    def current_interval(self, account_id):
+        """Seconds between sends the account is currently paced at."""
+        return 1 / self._account_bucket(account_id).rate
+
+    async def acquire(self, account_id, chat_id):
+        """Wait until account_id may send to chat_id."""
+        now = time.monotonic()
+        account_bucket = self._account_bucket(account_id)
+        account_wait = account_bucket.reserve(now)
+        wait = account_wait
+        chat_bucket = self._chat_bucket(chat_id)
+        if chat_bucket is not None:
+            wait = max(wait, chat_bucket.reserve(now))
+        if wait > 0:
+            wait += random.uniform(0, self.jitter)
+            # The send goes out later than the account's own slot: charge the extra
+            # delay to the account so its next send still keeps the full interval
+            account_bucket.defer(wait - account_wait)
+            await asyncio.sleep(wait)
+
+    def on_success(self, account_id):
+        """Additive increase after a send went through."""
+        entry = self._account_entry(account_id)
+        entry['bucket'].rate = min(entry['ceiling'], entry['bucket'].rate + self.increase_step)
+
+    def on_flood_wait(self, account_id, seconds, chat_id=None):
+        """Multiplicative decrease and a hard block for the FloodWait duration."""
+        bucket = self._account_bucket(account_id)
+        bucket.rate = max(self.min_rate, bucket.rate * self.decrease_factor)
+        bucket.block_for(seconds)
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        if chat_bucket is not None:
+            chat_bucket.block_for(seconds)
+        logger.info(f"Account {account_id} backed off to one send per {1 / bucket.rate:.1f}s after FloodWait {seconds}s")
+
+    def _account_entry(self, account_id):
+        entry = self._accounts.get(account_id)
+        if entry is None:
+            self.register_account(account_id, config.RATE_LIMIT_DEFAULT_INTERVAL)
+            entry = self._accounts.get(account_id)
+        else:
+            self._accounts.set(account_id, entry)  # Restart its idle timer
+        return entry
+
+    def _account_bucket(self, account_id):
+        return self._account_entry(account_id)['bucket']
+
+    def _chat_bucket(self, chat_id):
+        if self.chat_interval <= 0:
+            return None  # No per-chat limit
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(1 / self.chat_interval)
+        self._chats.set(chat_id, bucket)  # Insert, or restart its idle timer
+        return bucket
@@ -0,0 +1,211 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PREMIUM_PRIORITY = 0
+FREE_PRIORITY = 1
+
+
+class BroadcastScheduler:
+    """
+    Central scheduler that drives recurring broadcast cycles for many users.
+
+    Users sit in a heap ordered by next-due time. A dispatcher moves due users
+    into a bounded ready queue (premium users first), and a fixed pool of
+    workers runs their cycles. When every worker is busy and the ready queue is
+    full the dispatcher blocks, so overdue users wait in the heap instead of
+    piling up as tasks.
+
+    run_cycle(user_id) is awaited with the user's cycle timeout; it returns
+    False to stop scheduling that user. After each cycle the user is
+    rescheduled get_user_ad_delay() seconds later.
+
+    In sharded mode `owns(user_id)` limits the scheduler to this worker's
+    users and `leases` (a sharding.LeaseManager) must be held before a cycle
+    runs; a cycle whose lease is lost is cancelled.
+    """
+
+    def __init__(self, run_cycle, db, workers=config.SCHEDULER_WORKERS,
+                 max_ready=config.SCHEDULER_MAX_READY, owns=None, leases=None):
+        self.run_cycle = run_cycle
+        self.db = db
+        self.workers = workers
+        self.owns = owns
+        self.leases = leases
+        if leases is not None:
+            leases.on_lost = self._lease_lost
+        self._heap = []  # (due, seq, user_id); superseded entries are skipped
+        self._entries = {}  # user_id -> (seq, priority) of the live heap entry
+        self._ready = asyncio.PriorityQueue(maxsize=max_ready)
+        self._queued = set()  # users taken off the heap but not yet running
+        self._running = {}  # user_id -> task running its cycle
+        self._stopping = set()  # queued or running users removed before their cycle finished
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    async def add_user(self, user_id, delay=0):
+        """Schedule (or reschedule) user_id to run in `delay` seconds. Returns False if another shard owns the user."""
+        if self.owns is not None and not self.owns(user_id):
+            return False
+        self._stopping.discard(user_id)
+        premium = await self.db.is_user_premium(user_id)
+        self._push(user_id, delay, PREMIUM_PRIORITY if premium else FREE_PRIORITY)
+        return True
+
+    async def remove_user(self, user_id):
+        """Stop scheduling user_id; a cycle already running is left to finish."""
+        self._entries.pop(user_id, None)
+        if user_id in self._running or user_id in self._queued:
+            self._stopping.add(user_id)
+        elif self.leases is not None:
+            await self.leases.release(user_id)
+
+    async def sync_users(self, user_ids):
+        """Schedule every owned user in user_ids that is not already scheduled. Returns how many were added."""
+        added = 0
+        for user_id in user_ids:
+            if not self.is_scheduled(user_id) and await self.add_user(user_id):
+                added += 1
+        return added
+
+    def is_scheduled(self, user_id):
+        return user_id in self._entries or user_id in self._queued or user_id in self._running
+
+    def stats(self):
+        """Queue depth and worker utilisation."""
+        now = time.monotonic()
+        return {
+            "scheduled": len(self._entries),
+            "overdue": sum(1 for due, seq, uid in self._heap if due <= now and self._is_live(uid, seq)),
+            "queued": len(self._queued),
+            "ready": self._ready.qsize(),
+            "running": len(self._running),
+            "workers": self.workers
+        }
+
+    def start(self):
+        if self._tasks:
+            return
+        if self.leases is not None:
+            self.leases.start()
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        self._tasks.extend(asyncio.create_task(self._work(n)) for n in range(self.workers))
+        logger.info(f"Broadcast scheduler started with {self.workers} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.leases is not None:
+            await self.leases.stop()
+
+    def _push(self, user_id, delay, priority):
+        seq = next(self._seq)
+        self._entries[user_id] = (seq, priority)
+        heapq.heappush(self._heap, (time.monotonic() + delay, seq, user_id))
+        self._wakeup.set()
+
+    def _lease_lost(self, user_id):
+        """Another worker took user_id over: drop it here and cancel its running cycle."""
+        self._entries.pop(user_id, None)
+        task = self._running.get(user_id)
+        if task is not None:
+            self._stopping.add(user_id)
+            task.cancel()
+
+    def _is_live(self, user_id, seq):
+        entry = self._entries.get(user_id)
+        return entry is not None and entry[0] == seq
+
+    async def _dispatch(self):
+        while True:
+            # Drop superseded or removed entries at the top of the heap
+            while self._heap and not self._is_live(self._heap[0][2], self._heap[0][1]):
+                heapq.heappop(self._heap)
+
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, seq, user_id = self._heap[0]
+            wait = due - time.monotonic()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            _, priority = self._entries.pop(user_id)
+            self._queued.add(user_id)
+            # Blocks while the ready queue is full: backpressure on the whole heap
+            await self._ready.put((priority, due, seq, user_id))
+
+    async def _work(self, worker_id):
+        while True:
+            priority, due, seq, user_id = await self._ready.get()
+            try:
+                if user_id in self._stopping:
+                    # remove_user() while the user was waiting in the ready queue
+                    self._queued.discard(user_id)
+                    self._stopping.discard(user_id)
+                    if self.leases is not None:
+                        await self.leases.release(user_id)
+                    continue
+                if self.leases is not None and not await self.leases.acquire(user_id):
+                    self._queued.discard(user_id)
+                    logger.info(f"User {user_id} is leased by another worker, retrying in {self.leases.ttl}s")
+                    await self.add_user(user_id, delay=self.leases.ttl)
+                    continue
+                keep = await self._run(worker_id, user_id, due)
+            finally:
+                self._ready.task_done()
+
+            # remove_user() during the cycle, or an explicit add_user(), wins over the automatic reschedule
+            if user_id in self._stopping:
+                self._stopping.discard(user_id)
+                keep = False
+            if keep and user_id not in self._entries:
+                try:
+                    await self.add_user(user_id, delay=await self.db.get_user_ad_delay(user_id))
+                except Exception as e:
+                    logger.error(f"Failed to reschedule user {user_id}: {e}")
+            elif not keep and user_id not in self._entries and self.leases is not None:
+                await self.leases.release(user_id)
+
+    async def _run(self, worker_id, user_id, due):
+        """Run one cycle under the user's timeout. Returns False if the user should not be rescheduled."""
+        task = asyncio.ensure_future(self.run_cycle(user_id))
+        self._running[user_id] = task
+        self._queued.discard(user_id)
+        try:
+            lag = time.monotonic() - due
+            timeout = await self.db.get_user_cycle_timeout(user_id)
+            logger.info(f"Worker {worker_id} running cycle for user {user_id} ({lag:.1f}s late)")
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                logger.error(f"Cycle for user {user_id} exceeded its {timeout}s timeout")
+                return True
+            if task.cancelled():
+                logger.warning(f"Cycle for user {user_id} was cancelled")
+                return False
+            return task.result() is not False
+        except Exception as e:
+            logger.error(f"Cycle for user {user_id} failed: {e}")
+            return True
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            del self._running[user_id]
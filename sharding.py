@@ -0,0 +1,153 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value):
+    return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping user IDs to worker shards.
+
+    Each shard is placed on the ring `vnodes` times, so users spread evenly and
+    changing the number of shards only moves about 1/N of them.
+    """
+
+    def __init__(self, shards, vnodes=config.SHARD_VIRTUAL_NODES):
+        self.shards = list(shards)
+        self._ring = sorted((_hash(f"{shard}#{n}"), shard) for shard in self.shards for n in range(vnodes))
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, user_id):
+        """Shard responsible for user_id."""
+        if not self._ring:
+            return None
+        i = bisect.bisect(self._points, _hash(user_id)) % len(self._ring)
+        return self._ring[i][1]
+
+
+def local_shard_filter(index=config.WORKER_INDEX, total=config.WORKER_TOTAL):
+    """Predicate telling whether a user ID hashes to this worker's shard."""
+    ring = HashRing(range(total))
+    return lambda user_id: ring.owner(user_id) == index
+
+
+class LeaseManager:
+    """
+    Per-user leases on broadcast_states (lease_owner / lease_expires_at) so a
+    user's cycles run on exactly one worker, even while shards are rebalanced.
+
+    A lease is taken with one find_one_and_update that only matches when it is
+    free, expired or already ours, and a heartbeat task renews every held lease
+    in one update_many. Leases that fail to renew are reported to on_lost.
+    `collection` is an async (AsyncMongoClient) collection.
+    """
+
+    def __init__(self, collection, worker_id=config.WORKER_ID, ttl=config.LEASE_TTL,
+                 heartbeat_interval=config.LEASE_HEARTBEAT_INTERVAL, on_lost=None):
+        self.collection = collection
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.on_lost = on_lost
+        self.held = set()
+        self._task = None
+
+    def holds(self, user_id):
+        return user_id in self.held
+
+    async def acquire(self, user_id):
+        """Take or extend the lease on user_id. Returns True if this worker now holds it."""
+        now = datetime.utcnow()
+        try:
+            doc = await self.collection.find_one_and_update(
+                {
+                    "user_id": user_id,
+                    "$or": [
+                        {"lease_owner": self.worker_id},
+                        {"lease_owner": None},
+                        {"lease_expires_at": {"$lt": now}}
+                    ]
+                },
+                {"$set": {"lease_owner": self.worker_id, "lease_expires_at": now + timedelta(seconds=self.ttl)}},
+                projection={"_id": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The upsert lost to the existing document: another worker holds a live lease
+            doc = None
+        except Exception as e:
+            logger.error(f"Failed to acquire lease for {user_id}: {e}")
+            doc = None
+        acquired = doc is not None
+        if acquired:
+            self.held.add(user_id)
+        else:
+            self.held.discard(user_id)
+        return acquired
+
+    async def release(self, user_id):
+        """Give up the lease on user_id if this worker holds it."""
+        self.held.discard(user_id)
+        try:
+            await self.collection.update_one(
+                {"user_id": user_id, "lease_owner": self.worker_id},
+                {"$unset": {"lease_owner": "", "lease_expires_at": ""}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to release lease for {user_id}: {e}")
+
+    async def renew(self):
+        """Extend every held lease in one write and drop the ones another worker took over."""
+        if not self.held:
+            return
+        held = list(self.held)
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        try:
+            result = await self.collection.update_many(
+                {"user_id": {"$in": held}, "lease_owner": self.worker_id},
+                {"$set": {"lease_expires_at": expires_at}}
+            )
+            if result.matched_count == len(held):
+                return
+            cursor = self.collection.find({"user_id": {"$in": held}, "lease_owner": self.worker_id}, {"user_id": 1, "_id": 0})
+            still_held = {doc["user_id"] for doc in await cursor.to_list(length=None)}
+        except Exception as e:
+            logger.error(f"Lease heartbeat failed for worker {self.worker_id}: {e}")
+            return
+
+        for user_id in set(held) - still_held:
+            self.held.discard(user_id)
+            logger.warning(f"Worker {self.worker_id} lost the lease on user {user_id}")
+            if self.on_lost is not None:
+                self.on_lost(user_id)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        """Stop heartbeating and release every held lease so other workers can take over at once."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for user_id in list(self.held):
+            await self.release(user_id)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.renew()
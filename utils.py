@@ -73,10 +73,15 @@ def format_broadcast_summary(sent: int, failed: int, duration: timedelta) -> str
     )
 
 def create_analytics_summary(analytics: Dict) -> str:
-    """Create formatted analytics summary"""
+    """Create formatted analytics summary from the pre-aggregated totals of get_user_analytics"""
     total_sent = analytics.get('total_sent', 0)
     total_failed = analytics.get('total_failed', 0)
     success_rate = calculate_success_rate(total_sent, total_failed)
+    recent = analytics.get('recent')
+    recent_line = (
+        f"\n<blockquote>🕒 <b>Last 24h:</b> {recent.get('sent', 0):,} sent / {recent.get('failed', 0):,} failed</blockquote>"
+        if recent else ""
+    )
     
     return (
         f"📊 <blockquote><b>PERFORMANCE ANALYTICS</b></blockquote>\n\n"
@@ -85,6 +90,7 @@ def create_analytics_summary(analytics: Dict) -> str:
         f"<blockquote>❌ <b>Failed:</b> {total_failed:,}</blockquote>\n"
         f"<blockquote>🎯 <b>Success Rate:</b> {success_rate:.1f}%</blockquote>\n"
         f"<blockquote>📱 <b>Accounts:</b> {analytics.get('total_accounts', 0)}</blockquote>"
+        f"{recent_line}"
     )
 
 def format_error_message(error_type: str, context: str = "") -> str: